@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+AutoFilter Bot Search Benchmark
+Generates a synthetic release-style catalog, replays a mix of inline queries
+against a search backend and prints the results as JSON.
+
+Usage:
+    python bench.py                                  # in-memory index, 10k/100k/1M files
+    python bench.py --sizes 10000 --queries 5000
+    python bench.py --store mongo --backends regex,text,prefix,memory
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timedelta
+
+import psutil
+from bson import ObjectId
+
+# Add current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+
+logging.getLogger("bot").setLevel(logging.WARNING)
+
+# Catalog vocabulary
+TITLE_WORDS = [
+    "the", "last", "dark", "night", "city", "lost", "king", "queen", "black", "white",
+    "red", "blue", "house", "world", "war", "love", "dead", "man", "woman", "girl",
+    "boy", "star", "moon", "sun", "fire", "ice", "storm", "shadow", "secret", "silent",
+    "wild", "broken", "golden", "iron", "stone", "river", "ocean", "island", "mountain", "forest",
+    "empire", "kingdom", "legend", "hunter", "killer", "doctor", "detective", "agent", "soldier", "pirate",
+    "dragon", "wolf", "tiger", "eagle", "ghost", "witch", "angel", "demon", "hero", "stranger",
+    "road", "train", "game", "code", "mission", "escape", "return", "rise", "fall", "origin",
+    "avatar", "matrix", "inception", "interstellar", "gladiator", "titanic", "joker", "avengers", "frozen", "dune",
+    "breaking", "crown", "money", "heist", "squid", "stranger", "things", "office", "friends", "witcher",
+    "family", "brothers", "sisters", "journey", "paradise", "midnight", "summer", "winter", "zero", "infinity",
+]
+RESOLUTIONS = ["480p", "720p", "1080p", "2160p", "4K"]
+SOURCES = ["WEB-DL", "WEBRip", "BluRay", "HDRip", "HDTV", "DVDRip"]
+CODECS = ["x264", "x265", "HEVC", "AAC", "DDP5.1"]
+LANGUAGES = ["Hindi", "English", "Tamil", "Telugu", "Dual Audio", "Multi"]
+EXTENSIONS = [("mkv", "video"), ("mp4", "video"), ("avi", "video"), ("zip", "document"), ("mp3", "audio")]
+
+QUERY_KINDS = {
+    "prefix": 0.30,
+    "typo": 0.20,
+    "empty": 0.20,
+    "popular": 0.20,
+    "multi": 0.10,
+}
+
+def generate_titles(rng: random.Random, count: int) -> list:
+    """Generate distinct 1-4 word titles with a release year"""
+    titles = set()
+    while len(titles) < count:
+        words = rng.sample(TITLE_WORDS, rng.choice((1, 2, 2, 3, 3, 4)))
+        titles.add((" ".join(word.title() for word in words), rng.randint(1970, 2024)))
+    return sorted(titles)
+
+def generate_catalog(size: int, seed: int) -> tuple:
+    """Generate `size` file documents and the titles they were built from.
+    
+    Titles follow a Zipf-like popularity: a few titles get many releases
+    (resolutions, sources, episodes) and most get one or two.
+    """
+    rng = random.Random(seed)
+    titles = generate_titles(rng, max(10, size // 8))
+    weights = [1 / (rank + 1) for rank in range(len(titles))]
+    added_at = datetime(2024, 1, 1)
+    
+    docs = []
+    # One draw for the whole catalog: choices() rebuilds its cumulative weights on every call
+    picks = rng.choices(titles, weights=weights, k=size)
+    for i, (title, year) in enumerate(picks):
+        parts = [title.replace(" ", "."), str(year)]
+        if rng.random() < 0.3:
+            parts.append(f"S{rng.randint(1, 8):02d}E{rng.randint(1, 24):02d}")
+        parts += [rng.choice(RESOLUTIONS), rng.choice(SOURCES), rng.choice(CODECS)]
+        if rng.random() < 0.4:
+            parts.append(rng.choice(LANGUAGES).replace(" ", "."))
+        extension, file_type = rng.choice(EXTENSIONS)
+        file_name = f"{'.'.join(parts)}.{extension}"
+        caption = f"{title} ({year})\n\n{bot.BRANDING_TAG}" if rng.random() < 0.5 else ""
+    
+        file_doc = bot.FileDocument(
+            file_id=f"BQACAgUAAx{i:012d}",
+            file_name=file_name,
+            file_type=file_type,
+            file_size=rng.randint(50, 4000) * 1024 * 1024,
+            caption=caption,
+            file_unique_id=f"AgAD{i:012d}",
+        )
+        file_doc.added_at = added_at + timedelta(seconds=i)
+        doc = file_doc.to_dict()
+        doc["_id"] = ObjectId.from_datetime(file_doc.added_at)
+        doc["download_count"] = int(rng.paretovariate(1.2)) - 1
+        docs.append(doc)
+    return docs, titles
+
+def make_typo(rng: random.Random, word: str) -> str:
+    """Apply one random deletion, insertion, substitution or transposition"""
+    i = rng.randrange(len(word))
+    edit = rng.choice(("delete", "insert", "substitute", "transpose"))
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    if edit == "delete" and len(word) > 4:
+        return word[:i] + word[i + 1:]
+    if edit == "insert":
+        return word[:i] + letter + word[i:]
+    if edit == "transpose" and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + letter + word[i + 1:]
+
+def generate_queries(titles: list, count: int, seed: int) -> list:
+    """Build a replayable list of (kind, query text) pairs"""
+    rng = random.Random(seed + 1)
+    popular = titles[:max(1, len(titles) // 100)]
+    kinds = rng.choices(list(QUERY_KINDS), weights=list(QUERY_KINDS.values()), k=count)
+    
+    queries = []
+    for kind in kinds:
+        title, year = rng.choice(titles)
+        words = title.lower().split()
+        if kind == "prefix":
+            word = rng.choice(words)
+            text = word[:rng.randint(2, max(2, len(word)))]
+        elif kind == "typo":
+            long_words = [word for word in words if len(word) >= 5] or words
+            text = make_typo(rng, rng.choice(long_words))
+        elif kind == "popular":
+            title, year = rng.choice(popular)
+            text = title if rng.random() < 0.7 else f"{title} {year}"
+        elif kind == "multi":
+            text = f"{title} {rng.choice(RESOLUTIONS)}"
+        else:
+            text = ""
+        queries.append((kind, text))
+    return queries
+
+def percentiles(samples: list) -> dict:
+    """Return p50/p95/p99 of latencies in seconds, in milliseconds"""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(samples)
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99)}
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def git_commit() -> dict:
+    """Identify the checked-out commit so runs can be compared"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=root, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, text=True).strip())
+    except Exception:
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+async def load_memory(docs: list):
+    """Fill the in-memory search index and featured list directly (no database)"""
+    bot.search_index.clear()
+    for doc in docs:
+        # Same fields SearchIndex.load() reads from MongoDB
+        bot.search_index.add({key: value for key, value in doc.items() if key not in ("sources", "tokens")})
+    bot.search_index.loaded = True
+    
+    featured = bot.featured_files
+    projected = ("_id", *bot.SEARCH_PROJECTION)
+    featured._recent = [{key: doc[key] for key in projected} for doc in docs[:-featured.recent_size - 1:-1]]
+    popular = sorted((doc for doc in docs if doc["download_count"] > 0), key=lambda doc: doc["download_count"], reverse=True)
+    featured._popular = [{key: doc[key] for key in projected} for doc in popular[:featured.popular_size]]
+    featured._rebuild()
+    featured.loaded = True
+
+async def load_mongo(docs: list, database: str, batch_size: int = 10000):
+    """Write the catalog into a scratch database and point the bot at it"""
+    collection = bot.mongo_client[database].files
+    await collection.drop()
+    for i in range(0, len(docs), batch_size):
+        await collection.insert_many(docs[i:i + batch_size], ordered=False)
+    await collection.create_indexes(bot.SCHEMA_INDEXES["files"])
+    bot.files_collection = collection
+    bot.search_files_collection = collection
+    await bot.featured_files.load()
+
+async def replay(queries: list, page_size: int) -> dict:
+    """Run every query through search_files and the inline result renderer"""
+    search_times, inline_times = [], []
+    by_kind = {kind: [] for kind in QUERY_KINDS}
+    hits = 0
+    
+    started = time.perf_counter()
+    for kind, text in queries:
+        t0 = time.perf_counter()
+        files = await bot.FileDocument.search_files(text, limit=page_size)
+        t1 = time.perf_counter()
+        bot.build_file_results(files)
+        t2 = time.perf_counter()
+    
+        search_times.append(t1 - t0)
+        inline_times.append(t2 - t0)
+        by_kind[kind].append(t2 - t0)
+        hits += bool(files)
+    elapsed = time.perf_counter() - started
+    
+    return {
+        "queries": len(queries),
+        "hit_rate": round(hits / len(queries), 4) if queries else None,
+        "throughput_qps": round(len(queries) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "search": percentiles(search_times),
+            "inline": percentiles(inline_times),
+        },
+        "by_kind_ms": {kind: percentiles(samples) for kind, samples in by_kind.items()},
+    }
+
+async def run(args) -> dict:
+    report = {
+        **git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "store": args.store,
+            "backends": args.backends,
+            "queries": args.queries,
+            "page_size": args.page_size,
+            "seed": args.seed,
+        },
+        "runs": [],
+    }
+    
+    for size in args.sizes:
+        print(f"Generating {size:,} files...", file=sys.stderr)
+        docs, titles = generate_catalog(size, args.seed)
+        queries = generate_queries(titles, args.queries, args.seed)
+    
+        for backend in args.backends:
+            bot.render_cache.clear()
+            bot.search_backend = bot.create_search_backend(backend)
+    
+            print(f"Loading {size:,} files for {backend} ({args.store})...", file=sys.stderr)
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            if args.store == "mongo":
+                await load_mongo(docs, args.database)
+                if backend == "memory":
+                    await bot.search_index.load()
+            else:
+                await load_memory(docs)
+            build_seconds = time.perf_counter() - started
+            rss_after = rss_mb()
+    
+            print(f"Replaying {len(queries):,} queries...", file=sys.stderr)
+            result = await replay(queries, args.page_size)
+            report["runs"].append({
+                "size": size,
+                "backend": backend,
+                "store": args.store,
+                "build_seconds": round(build_seconds, 3),
+                "memory_mb": {
+                    "rss": round(rss_mb(), 1),
+                    "load_delta": round(rss_after - rss_before, 1),
+                },
+                **result,
+            })
+    
+            bot.search_index.clear()
+        del docs
+    
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark AutoFilter Bot search on a synthetic catalog")
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated catalog sizes (default: 10000,100000,1000000)")
+    parser.add_argument("--store", choices=("memory", "mongo"), default="memory",
+                        help="in-memory stand-in or a local MongoDB at MONGO_URI (default: memory)")
+    parser.add_argument("--backends", default="memory",
+                        help=f"comma-separated search backends: {', '.join(bot.SEARCH_BACKENDS)} (default: memory)")
+    parser.add_argument("--database", default="AutoFilterBot_bench",
+                        help="scratch database for --store mongo; it is dropped and refilled")
+    parser.add_argument("--queries", type=int, default=2000, help="queries replayed per run (default: 2000)")
+    parser.add_argument("--page-size", type=int, default=20, help="results per query (default: 20)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for catalog and queries")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.backends = [backend.strip() for backend in args.backends.split(",")]
+    unknown = [backend for backend in args.backends if backend not in bot.SEARCH_BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+    if args.store == "memory" and args.backends != ["memory"]:
+        parser.error("only the memory backend runs without MongoDB; use --store mongo")
+    return args
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
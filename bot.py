@@ -6,37 +6,195 @@ Built with Pyrogram for maximum performance and reliability
 """
 
 import os
+import sys
 import asyncio
 import logging
+import logging.handlers
+import queue
+import atexit
+import json
+import copy
 import time
+import threading
+import multiprocessing
+import multiprocessing.connection
+import signal
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 import re
 import random
-
-from pyrogram import Client, filters, enums
+import functools
+import heapq
+import hashlib
+import base64
+import math
+from bisect import bisect_left, insort
+from itertools import islice, zip_longest
+from collections import OrderedDict
+
+from pyrogram import Client, filters, enums, idle, StopPropagation, ContinuePropagation
 from pyrogram.types import (
     Message, InlineKeyboardMarkup, InlineKeyboardButton,
     InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
-    CallbackQuery, User
+    CallbackQuery, User, ChatMemberUpdated, ChosenInlineResult
 )
 from pyrogram.errors import (
     FloodWait, UserNotParticipant, ChatAdminRequired,
-    PeerIdInvalid, UserBannedInChannel, MessageNotModified
+    PeerIdInvalid, UserBannedInChannel, MessageNotModified,
+    UserIsBlocked, InputUserDeactivated
 )
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
+from pymongo import MongoClient, IndexModel, UpdateOne, ASCENDING, DESCENDING, TEXT, ReadPreference, monitoring
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError, BulkWriteError
+from bson import ObjectId
 import motor.motor_asyncio
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '7'))
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20'))
+LOG_RATE_INTERVAL = int(os.getenv('LOG_RATE_INTERVAL', '60'))
+
+class SizedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rotate at LOG_ROTATE_WHEN boundaries and whenever the file would exceed max_bytes"""
+
+    def __init__(self, filename: str, max_bytes: int, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes and self.stream is not None:
+            self.stream.seek(0, 2)
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+    def rotation_filename(self, default_name: str) -> str:
+        # Several size rollovers can happen within one period: like RotatingFileHandler,
+        # shift the older ones to .1, .2, ... so the dated name always holds the newest
+        name = super().rotation_filename(default_name)
+        if os.path.exists(name):
+            count = 1
+            while os.path.exists(f"{name}.{count}"):
+                count += 1
+            for index in range(count - 1, 0, -1):
+                os.replace(f"{name}.{index}", f"{name}.{index + 1}")
+            os.replace(name, f"{name}.1")
+        return name
+
+    def getFilesToDelete(self) -> list:
+        """Return the backups beyond backupCount, oldest first (earlier periods, then higher numbers)"""
+        directory, base_name = os.path.split(self.baseFilename)
+        prefix = base_name + "."
+        backups = []
+        for file_name in os.listdir(directory):
+            suffix = file_name[len(prefix):]
+            if not file_name.startswith(prefix) or not self.extMatch.match(suffix):
+                continue
+            stamp, _, number = suffix.partition(".")
+            if number and not number.isdigit():
+                continue
+            backups.append((stamp, -int(number or 0), os.path.join(directory, file_name)))
+        backups.sort()
+        return [path for _, _, path in backups[:max(0, len(backups) - self.backupCount)]]
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `limit` INFO-or-lower records per call site through every `interval` seconds.
+
+    Warnings and errors always pass. The first record after a throttled
+    window reports how many were dropped.
+    """
+
+    def __init__(self, limit: int, interval: int):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows: Dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.limit or record.levelno > logging.INFO:
+            return True
+        
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+            return True
+        
+        if window[1] < self.limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the exception on queued records.
+
+    The stock prepare() folds the traceback into the message and drops
+    exc_info, which leaves JsonFormatter nothing to put in "exception". The
+    queue never leaves the process, so the listener's formatters can render
+    the traceback themselves.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route every record through a queue so file and console writes happen off the event loop"""
+    formatter = (JsonFormatter() if LOG_FORMAT == "json"
+                 else logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    if LOG_ROTATE_WHEN:
+        file_handler = SizedTimedRotatingFileHandler(
+            LOG_FILE, max_bytes=LOG_MAX_BYTES, when=LOG_ROTATE_WHEN,
+            backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    stream_handler = logging.StreamHandler()
+    for output in (file_handler, stream_handler):
+        output.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_INTERVAL))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+    
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    # Drain the queue into the files before the interpreter exits
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Configuration - You can use environment variables or set directly
@@ -49,14 +207,356 @@ OWNER_ID = int(os.getenv('OWNER_ID', '1633472140'))
 REQUIRED_CHANNEL = os.getenv('REQUIRED_CHANNEL', '-1001557378145')
 SOURCE_CHANNEL_IDS = [int(x) for x in os.getenv('SOURCE_CHANNEL_IDS', '-1001860710176').split(',')]
 BRANDING_TAG = os.getenv('BRANDING_TAG', 'Uploaded By @Netflixian_Movie')
+SEARCH_INDEX_ENABLED = os.getenv('SEARCH_INDEX_ENABLED', 'false').lower() == 'true'
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'memory' if SEARCH_INDEX_ENABLED else 'regex').lower()
+SCHEMA_CHECK = os.getenv('SCHEMA_CHECK', 'false').lower() == 'true'
+SUBSCRIPTION_CACHE_TTL = int(os.getenv('SUBSCRIPTION_CACHE_TTL', '3600'))
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv('SUBSCRIPTION_NEGATIVE_TTL', '60'))
+SUBSCRIPTION_EVENT_TTL = int(os.getenv('SUBSCRIPTION_EVENT_TTL', '86400'))
+BAN_RECONCILE_INTERVAL = int(os.getenv('BAN_RECONCILE_INTERVAL', '300'))
+BAN_BLOOM_THRESHOLD = int(os.getenv('BAN_BLOOM_THRESHOLD', '100000'))
+USER_FLUSH_INTERVAL = int(os.getenv('USER_FLUSH_INTERVAL', '5'))
+USER_FLUSH_BATCH = int(os.getenv('USER_FLUSH_BATCH', '1000'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '500'))
+BROADCAST_PROGRESS_INTERVAL = int(os.getenv('BROADCAST_PROGRESS_INTERVAL', '10'))
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1000'))
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', '60'))
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '5000'))
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', '0.3'))
+FEATURED_RECENT = int(os.getenv('FEATURED_RECENT', '50'))
+FEATURED_POPULAR = int(os.getenv('FEATURED_POPULAR', '50'))
+DOWNLOAD_FLUSH_INTERVAL = int(os.getenv('DOWNLOAD_FLUSH_INTERVAL', '60'))
+SEARCH_NAME_BOOST = float(os.getenv('SEARCH_NAME_BOOST', '3'))
+SEARCH_MAX_EDIT_DISTANCE = int(os.getenv('SEARCH_MAX_EDIT_DISTANCE', '2'))
+SEARCH_MAX_EXPANSIONS = int(os.getenv('SEARCH_MAX_EXPANSIONS', '50'))
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', '0'))
+SEARCH_WORKER_TIMEOUT = float(os.getenv('SEARCH_WORKER_TIMEOUT', '2'))
+BACKFILL_PAGE_SIZE = int(os.getenv('BACKFILL_PAGE_SIZE', '200'))
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', '1000'))
+BACKFILL_PROGRESS_INTERVAL = int(os.getenv('BACKFILL_PROGRESS_INTERVAL', '10'))
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '10000'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '1'))
+ADMIN_CACHE_TTL = int(os.getenv('ADMIN_CACHE_TTL', '600'))
+STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', '300'))
+STATS_TYPE_RECONCILE_INTERVAL = int(os.getenv('STATS_TYPE_RECONCILE_INTERVAL', '21600'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '10000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0'))
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', 'zlib')
+MONGO_RETRY_WRITES = os.getenv('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+MONGO_RETRY_READS = os.getenv('MONGO_RETRY_READS', 'true').lower() == 'true'
+MONGO_SEARCH_READ_PREFERENCE = os.getenv('MONGO_SEARCH_READ_PREFERENCE', 'primary')
+MONGO_STATS_READ_PREFERENCE = os.getenv('MONGO_STATS_READ_PREFERENCE', 'primary')
+MONGO_POOL_LOG_INTERVAL = int(os.getenv('MONGO_POOL_LOG_INTERVAL', '300'))
 
 # Validate required configuration
 if not all([API_ID, API_HASH, BOT_TOKEN, MONGO_URI, OWNER_ID]):
     logger.error("Missing required configuration!")
     exit(1)
 
+# Metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative latency histogram with fixed Prometheus-style buckets"""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def merge(self, other: "Histogram"):
+        self.count += other.count
+        self.sum += other.sum
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation (inf past the last bucket)"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """Latency histograms and counters for handlers, MongoDB commands and Telegram API calls.
+
+    Every series has one label: the handler name, the Mongo command name or
+    the Telegram method. render() produces the Prometheus text exposition
+    format served on METRICS_PORT.
+    """
+
+    HISTOGRAMS = {
+        "handler": ("autofilter_handler_seconds", "handler", "Update handler latency"),
+        "mongo": ("autofilter_mongo_command_seconds", "command", "MongoDB command latency"),
+        "telegram": ("autofilter_telegram_call_seconds", "method", "Telegram API call latency"),
+        "mongo_pool": ("autofilter_mongo_pool_wait_seconds", "address", "Wait for a pooled MongoDB connection"),
+    }
+    COUNTERS = {
+        "handler_errors": ("autofilter_handler_errors_total", "handler", "Update handlers that raised"),
+        "mongo_errors": ("autofilter_mongo_command_errors_total", "command", "Failed MongoDB commands"),
+        "telegram_errors": ("autofilter_telegram_call_errors_total", "method", "Failed Telegram API calls"),
+        "floodwait": ("autofilter_telegram_floodwait_seconds_total", "method", "Seconds of FloodWait imposed by Telegram"),
+        "mongo_pool_failures": ("autofilter_mongo_pool_checkout_failures_total", "reason", "Failed MongoDB connection checkouts"),
+    }
+
+    def __init__(self):
+        self.started = time.time()
+        self._histograms: Dict[str, Dict[str, Histogram]] = {family: {} for family in self.HISTOGRAMS}
+        self._counters: Dict[str, Dict[str, float]] = {family: {} for family in self.COUNTERS}
+
+    def observe(self, family: str, label: str, seconds: float):
+        series = self._histograms[family]
+        histogram = series.get(label)
+        if histogram is None:
+            histogram = series[label] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, family: str, label: str, amount: float = 1):
+        series = self._counters[family]
+        series[label] = series.get(label, 0) + amount
+
+    def total(self, family: str) -> Histogram:
+        """Merge every series of a histogram family"""
+        merged = Histogram()
+        for histogram in self._histograms[family].values():
+            merged.merge(histogram)
+        return merged
+
+    def counter_total(self, family: str) -> float:
+        return sum(self._counters[family].values())
+
+    def render(self) -> str:
+        """Format every metric in the Prometheus text exposition format"""
+        lines = [
+            "# HELP autofilter_uptime_seconds Seconds since the bot started",
+            "# TYPE autofilter_uptime_seconds gauge",
+            f"autofilter_uptime_seconds {time.time() - self.started:.0f}",
+        ]
+        for family, (name, label_name, help_text) in self.HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for label, histogram in sorted(self._histograms[family].items()):
+                label_pair = f'{label_name}="{label}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label_pair},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label_pair},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{label_pair}}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{label_pair}}} {histogram.count}")
+        for family, (name, label_name, help_text) in self.COUNTERS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for label, value in sorted(self._counters[family].items()):
+                lines.append(f'{name}{{{label_name}="{label}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self, family: str, errors: str) -> str:
+        """One-line count / p95 / errors summary for /status"""
+        histogram = self.total(family)
+        if not histogram.count:
+            return "no calls yet"
+        p95 = histogram.quantile(0.95)
+        p95_text = f"≤{p95 * 1000:.0f}ms" if p95 != float("inf") else f">{LATENCY_BUCKETS[-1]:.0f}s"
+        average = histogram.sum / histogram.count * 1000
+        return (f"{histogram.count:,} calls, avg {average:.0f}ms, p95 {p95_text}, "
+                f"{self.counter_total(errors):,.0f} errors")
+
+metrics = Metrics()
+
+def instrument_handler(func):
+    """Record latency and errors of an update handler"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except (StopPropagation, ContinuePropagation):
+            raise
+        except Exception:
+            metrics.inc("handler_errors", func.__name__)
+            raise
+        finally:
+            metrics.observe("handler", func.__name__, time.perf_counter() - started)
+    return wrapper
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding MongoDB latency into metrics"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.observe("mongo", event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        metrics.observe("mongo", event.command_name, event.duration_micros / 1e6)
+        metrics.inc("mongo_errors", event.command_name)
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """pymongo pool listener measuring how long operations wait for a connection.
+
+    Check-out start and completion are reported on the same driver thread,
+    so the start time is kept thread-locally. log_summary() reports the
+    waits since the previous call.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.in_use = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_started = time.monotonic()
+        self.window_checkouts = 0
+        self.window_wait = 0.0
+        self.window_max_wait = 0.0
+        self.window_failures = 0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self.in_use += 1
+        started = getattr(self._local, "started", None)
+        if started is None:
+            return
+        wait = time.perf_counter() - started
+        self._local.started = None
+        metrics.observe("mongo_pool", f"{event.address[0]}:{event.address[1]}", wait)
+        self.window_checkouts += 1
+        self.window_wait += wait
+        self.window_max_wait = max(self.window_max_wait, wait)
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        self.window_failures += 1
+        metrics.inc("mongo_pool_failures", str(event.reason))
+
+    def connection_checked_in(self, event):
+        self.in_use = max(0, self.in_use - 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    async def log_summary(self):
+        """Log pool saturation since the previous summary"""
+        elapsed = time.monotonic() - self.window_started
+        if self.window_checkouts or self.window_failures:
+            average = self.window_wait / self.window_checkouts * 1000 if self.window_checkouts else 0.0
+            log = logger.warning if self.window_failures else logger.info
+            log(f"Mongo pool: {self.window_checkouts:,} checkouts in {elapsed:.0f}s, "
+                f"wait avg {average:.1f}ms max {self.window_max_wait * 1000:.1f}ms, "
+                f"{self.in_use}/{MONGO_MAX_POOL_SIZE} in use, {self.window_failures} failed")
+        self._reset_window()
+
+mongo_pool_metrics = MongoPoolMetrics()
+
+def telegram_method(query) -> str:
+    """Name a raw API function the way Pyrogram logs it, e.g. messages.SendMessage"""
+    return ".".join(getattr(query, "QUALNAME", type(query).__name__).split(".")[1:]) or type(query).__name__
+
+class InstrumentedClient(Client):
+    """Pyrogram client that records latency, errors and FloodWait time of every API call"""
+
+    async def invoke(self, query, *args, **kwargs):
+        method = telegram_method(query)
+        started = time.perf_counter()
+        try:
+            return await super().invoke(query, *args, **kwargs)
+        except FloodWait as e:
+            metrics.inc("floodwait", method, e.value)
+            metrics.inc("telegram_errors", method)
+            raise
+        except Exception:
+            metrics.inc("telegram_errors", method)
+            raise
+        finally:
+            metrics.observe("telegram", method, time.perf_counter() - started)
+
+class FloodWaitLogFilter(logging.Filter):
+    """Count FloodWaits that Pyrogram sleeps through itself (below sleep_threshold).
+
+    These never reach InstrumentedClient.invoke; the session only logs
+    'Waiting for %s seconds before continuing (required by "%s")'.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.msg.__class__ is str and "Waiting for" in record.msg and len(record.args or ()) == 3:
+            _, amount, method = record.args
+            metrics.inc("floodwait", str(method), float(amount))
+        return True
+
+logging.getLogger("pyrogram.session.session").addFilter(FloodWaitLogFilter())
+
+async def serve_metrics(host: str, port: int):
+    """Serve metrics.render() on http://host:port/metrics"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request body is never used
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
+
 # Initialize Pyrogram client
-app = Client(
+app = InstrumentedClient(
     "AutoFilterBot",
     api_id=API_ID,
     api_hash=API_HASH,
@@ -65,8 +565,45 @@ app = Client(
 )
 
 # MongoDB connection
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primarypreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondarypreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+def read_preference(name: str):
+    """Resolve a read preference name such as secondaryPreferred, defaulting to primary"""
+    preference = READ_PREFERENCES.get(name.lower())
+    if preference is None:
+        logger.error(f"Unknown read preference '{name}', using primary")
+        preference = ReadPreference.PRIMARY
+    return preference
+
+def create_mongo_client() -> motor.motor_asyncio.AsyncIOMotorClient:
+    """Build the Motor client from the MONGO_* settings (they override options in MONGO_URI)"""
+    options = {
+        "appname": "AutoFilterBot",
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "retryWrites": MONGO_RETRY_WRITES,
+        "retryReads": MONGO_RETRY_READS,
+        "event_listeners": [MongoCommandMetrics(), mongo_pool_metrics],
+    }
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI, **options)
+
 try:
-    mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
+    mongo_client = create_mongo_client()
     db = mongo_client[DB_NAME]
     logger.info(f"Connected to MongoDB successfully - Database: {DB_NAME}")
 except Exception as e:
@@ -79,68 +616,931 @@ files_collection = db.files
 banned_collection = db.banned_users
 groups_collection = db.groups
 settings_collection = db.settings
+broadcasts_collection = db.broadcasts
+backfill_collection = db.backfill
+
+# Read routing: writes and read-your-writes lookups stay on the primary
+search_files_collection = files_collection.with_options(read_preference=read_preference(MONGO_SEARCH_READ_PREFERENCE))
+stats_db = db.with_options(read_preference=read_preference(MONGO_STATS_READ_PREFERENCE))
+
+# Database schema
+# Every index the handlers rely on, created and verified once at startup
+SCHEMA_INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "files": [
+        IndexModel([("file_id", ASCENDING)], unique=True),
+        IndexModel([("file_name", TEXT), ("caption", TEXT)]),
+        IndexModel([("tokens", ASCENDING)]),
+        IndexModel([("file_unique_id", ASCENDING)], sparse=True),
+        IndexModel([("content_key", ASCENDING)]),
+        IndexModel([("normalized_name", ASCENDING)]),
+        IndexModel([("download_count", DESCENDING)]),
+    ],
+    "banned_users": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "groups": [
+        IndexModel([("group_id", ASCENDING)], unique=True),
+    ],
+    "broadcasts": [
+        IndexModel([("status", ASCENDING), ("started_at", DESCENDING)]),
+    ],
+}
+
+# Representative handler queries that must be served by an index (checked with explain())
+SCHEMA_QUERIES = [
+    ("users", {"user_id": 0}, "add_user / broadcast lookup"),
+    ("banned_users", {"user_id": 0}, "is_banned / unban_command"),
+    ("files", {"file_id": ""}, "FileDocument.save upsert"),
+    ("files", {"tokens": "movie"}, "token lookup"),
+    ("files", {"normalized_name": {"$regex": "^movie"}}, "prefix search backend"),
+    ("files", {"$text": {"$search": "movie"}}, "text search backend"),
+    ("files", {"download_count": {"$gt": 0}}, "popular files"),
+    ("files", {"$or": [{"file_unique_id": ""}, {"content_key": ""}, {"file_id": ""}]}, "ingest deduplication upsert"),
+    ("groups", {"group_id": 0}, "group registration upsert"),
+]
+
+def _plan_stages(plan: Dict) -> List[str]:
+    """Flatten the stage names of an explain() query plan"""
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+def _index_matches(keys: List[tuple], info: Dict) -> bool:
+    """Compare declared index keys with an index_information() entry"""
+    text_fields = {field for field, kind in keys if kind == TEXT}
+    if text_fields:
+        # MongoDB reports text indexes as _fts/_ftsx keys; the indexed fields are in "weights"
+        return set(info.get("weights", {})) == text_fields
+    return info["key"] == keys
+
+async def create_schema_indexes() -> bool:
+    """Create and verify every declared index"""
+    ok = True
+    for collection_name, models in SCHEMA_INDEXES.items():
+        collection = db[collection_name]
+        try:
+            await collection.create_indexes(models)
+        except Exception as e:
+            logger.error(f"Error creating indexes on {collection_name}: {e}")
+        
+        try:
+            existing = await collection.index_information()
+        except Exception as e:
+            logger.error(f"Error reading indexes of {collection_name}: {e}")
+            ok = False
+            continue
+        
+        for model in models:
+            spec = model.document
+            keys = list(spec["key"].items())
+            match = next((info for info in existing.values() if _index_matches(keys, info)), None)
+            if match is None:
+                logger.error(f"Missing index on {collection_name}: {keys}")
+                ok = False
+            elif spec.get("unique") and not match.get("unique"):
+                logger.error(f"Index on {collection_name} {keys} exists but is not unique "
+                             f"(remove duplicates and drop the old index)")
+                ok = False
+    return ok
+
+async def check_schema_queries() -> bool:
+    """Run explain() on the handler queries and flag any collection scan"""
+    ok = True
+    for collection_name, query, description in SCHEMA_QUERIES:
+        try:
+            plan = await db[collection_name].find(query).explain()
+            stages = _plan_stages(plan["queryPlanner"]["winningPlan"])
+        except Exception as e:
+            logger.error(f"Error explaining {description} on {collection_name}: {e}")
+            ok = False
+            continue
+        
+        if "COLLSCAN" in stages:
+            logger.error(f"COLLSCAN for {description} on {collection_name}: {query}")
+            ok = False
+        else:
+            logger.info(f"Query plan OK for {description}: {' <- '.join(stages)}")
+    return ok
+
+async def ensure_schema(check: bool = False) -> bool:
+    """Bootstrap the database schema, optionally verifying handler query plans"""
+    ok = await create_schema_indexes()
+    if check:
+        ok = await check_schema_queries() and ok
+    if ok:
+        logger.info("Database schema verified")
+    return ok
 
 # Bot start time for uptime calculation
 BOT_START_TIME = time.time()
 
+# Required channel membership mirror
+class MembershipMirror:
+    """Local mirror of REQUIRED_CHANNEL membership.
+
+    Entries come from two places: chat_member updates of the channel (the
+    bot must be an admin there to receive them) and get_chat_member lookups
+    for users not seen yet. Lookup results expire after a positive or a
+    shorter negative TTL, so a user who just joined is re-checked soon.
+    """
+
+    def __init__(self, positive_ttl: int, negative_ttl: int, event_ttl: int, max_entries: int = 200000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.event_ttl = event_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[bool]:
+        """Return the cached membership of a user, or None if unknown or expired"""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def remember(self, user_id: int, is_member: bool, from_update: bool = False):
+        """Store membership from an API lookup or a chat_member update"""
+        if from_update:
+            ttl = self.event_ttl
+        else:
+            ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then the oldest ones, down to 90% of capacity.
+
+        Evicting in bulk keeps the next eviction max_entries / 10 inserts
+        away, so the scan costs amortised O(1) per remember().
+        """
+        now = time.monotonic()
+        for uid in [uid for uid, entry in self._entries.items() if entry[1] < now]:
+            del self._entries[uid]
+        target = self.max_entries * 9 // 10
+        while len(self._entries) > target:
+            self._entries.popitem(last=False)
+
+membership_mirror = MembershipMirror(
+    positive_ttl=SUBSCRIPTION_CACHE_TTL,
+    negative_ttl=SUBSCRIPTION_NEGATIVE_TTL,
+    event_ttl=SUBSCRIPTION_EVENT_TTL
+)
+
+def is_required_channel(chat) -> bool:
+    """Check whether a chat is the configured REQUIRED_CHANNEL"""
+    if chat is None:
+        return False
+    if str(chat.id) == REQUIRED_CHANNEL:
+        return True
+    return bool(chat.username) and chat.username.lower() == REQUIRED_CHANNEL.lstrip('@').lower()
+
+# Banned users
+class BloomFilter:
+    """Fixed-size bloom filter over integer ids"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: int):
+        digest = hashlib.blake2b(item.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: int):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class BannedUsers:
+    """In-memory view of banned_collection.
+
+    Small lists are held in a plain set. Once the list reaches
+    BAN_BLOOM_THRESHOLD it is held in a bloom filter instead, and the rare
+    positive answer is confirmed against MongoDB. ban_command and
+    unban_command update it directly; a periodic reload picks up changes
+    made by other instances.
+    """
+
+    def __init__(self, bloom_threshold: int):
+        self.bloom_threshold = bloom_threshold
+        self.loaded = False
+        self.count = 0
+        self._ids: set = set()
+        self._bloom: Optional[BloomFilter] = None
+
+    async def load(self):
+        """Reload the banned list from the database"""
+        ids = set()
+        async for doc in banned_collection.find({}, {"user_id": 1, "_id": 0}):
+            ids.add(doc["user_id"])
+        
+        if len(ids) >= self.bloom_threshold:
+            # Leave headroom so bans added before the next reload keep the error rate low
+            bloom = BloomFilter(capacity=len(ids) * 2)
+            for user_id in ids:
+                bloom.add(user_id)
+            self._bloom, self._ids = bloom, set()
+        else:
+            self._bloom, self._ids = None, ids
+        self.count = len(ids)
+        self.loaded = True
+
+    def add(self, user_id: int):
+        if self._bloom is not None:
+            self._bloom.add(user_id)
+        elif user_id not in self._ids:
+            self._ids.add(user_id)
+        else:
+            return
+        self.count += 1
+
+    def discard(self, user_id: int):
+        # Bloom filters can't forget; the database confirms until the next reload
+        if self._bloom is None:
+            self._ids.discard(user_id)
+        self.count = max(self.count - 1, 0)
+
+    async def contains(self, user_id: int) -> bool:
+        """Check membership, going to the database only when unavoidable"""
+        if not self.loaded:
+            return await banned_collection.find_one({"user_id": user_id}, {"_id": 1}) is not None
+        if self._bloom is None:
+            return user_id in self._ids
+        if user_id not in self._bloom:
+            return False
+        return await banned_collection.find_one({"user_id": user_id}, {"_id": 1}) is not None
+
+banned_users = BannedUsers(bloom_threshold=BAN_BLOOM_THRESHOLD)
+
+# User activity write-behind buffer
+class UserActivityBuffer:
+    """Merge user activity per user_id and write it to users_collection in batches.
+
+    add_user only records the latest username, first name and activity time
+    in memory. A background task flushes the merged entries with one unordered
+    bulk_write every USER_FLUSH_INTERVAL seconds, or sooner once
+    USER_FLUSH_BATCH distinct users are pending. joined_at is only written
+    when the user document is first inserted.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self._pending: Dict[int, Dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_users = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def record(self, user_id: int, username: str = None, first_name: str = None):
+        """Merge one activity event into the pending batch"""
+        self._pending[user_id] = {
+            "username": username,
+            "first_name": first_name,
+            "last_active": datetime.now()
+        }
+        if len(self._pending) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Write every pending entry to the database"""
+        if not self._pending:
+            return
+        
+        pending, self._pending = self._pending, {}
+        operations = [
+            UpdateOne(
+                {"user_id": user_id},
+                {
+                    "$set": {"user_id": user_id, **activity},
+                    "$setOnInsert": {"joined_at": activity["last_active"]}
+                },
+                upsert=True
+            )
+            for user_id, activity in pending.items()
+        ]
+        
+        started = time.perf_counter()
+        try:
+            result = await users_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Error flushing activity of {len(pending)} users: {e}")
+            # Put the batch back without overwriting newer activity
+            for user_id, activity in pending.items():
+                self._pending.setdefault(user_id, activity)
+            return
+        finally:
+            self.last_flush_latency = time.perf_counter() - started
+            self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+        
+        self.flushes += 1
+        self.flushed_users += len(pending)
+        stats.users += result.upserted_count
+
+    async def close(self):
+        """Wait for an early flush still in flight, then write what is left on shutdown"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+user_activity = UserActivityBuffer(batch_size=USER_FLUSH_BATCH)
+
+# Broadcast engine
+class TokenBucket:
+    """Token-bucket rate limiter shared by every broadcast sender"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Hold every sender for `seconds` (used on FloodWait)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastEngine:
+    """Concurrent, rate-limited and resumable broadcast to every user.
+
+    Users are read in user_id order in batches of BROADCAST_BATCH_SIZE and
+    sent to by BROADCAST_CONCURRENCY senders sharing one token bucket of
+    BROADCAST_RATE messages per second. A FloodWait pauses the whole bucket.
+    Results count in user_id order up to the first unfinished send, and that
+    watermark (last_user_id plus the counters) is checkpointed in
+    broadcasts_collection after every batch and when the broadcast stops, so
+    a resume repeats at most the sends that were in flight.
+    """
+
+    def __init__(self, concurrency: int, rate: float, batch_size: int, progress_interval: int):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.limiter = TokenBucket(rate)
+        self.state: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._cancelled = False
+        self._run_started = 0.0
+        self._run_processed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, client: Client, source: Message, progress_message: Message):
+        """Start broadcasting `source` to every user"""
+        state = {
+            "from_chat_id": source.chat.id,
+            "message_id": source.id,
+            "status": "running",
+            "last_user_id": None,
+            "success": 0,
+            "failed": 0,
+            "skipped": 0,
+            "total": await get_user_count(),
+            "started_at": datetime.now(),
+            "updated_at": datetime.now()
+        }
+        result = await broadcasts_collection.insert_one(state)
+        state["_id"] = result.inserted_id
+        self._launch(client, state, progress_message)
+
+    async def resume(self, client: Client, progress_message: Message) -> bool:
+        """Resume the latest unfinished broadcast, if any"""
+        state = await broadcasts_collection.find_one(
+            {"status": {"$in": ["running", "interrupted"]}},
+            sort=[("started_at", -1)]
+        )
+        if state is None:
+            return False
+        state["status"] = "running"
+        self._launch(client, state, progress_message)
+        return True
+
+    def cancel(self) -> bool:
+        """Stop the running broadcast and mark it cancelled"""
+        if not self.running:
+            return False
+        self._cancelled = True
+        self._task.cancel()
+        return True
+
+    async def stop(self):
+        """Interrupt the running broadcast on shutdown, keeping it resumable"""
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _launch(self, client: Client, state: Dict, progress_message: Message):
+        self.state = state
+        self._cancelled = False
+        self._run_started = time.monotonic()
+        self._run_processed = 0
+        self._task = asyncio.create_task(self._run(client, state, progress_message))
+
+    def progress_text(self) -> str:
+        """Render the progress of the current or last broadcast"""
+        state = self.state
+        if state is None:
+            return "📢 No broadcast has been run since startup."
+        
+        done = state["success"] + state["failed"] + state["skipped"]
+        total = max(state["total"], done, 1)
+        elapsed = max(time.monotonic() - self._run_started, 1e-6)
+        rate = self._run_processed / elapsed
+        eta = f"{int((total - done) / rate)}s" if rate > 0 and state["status"] == "running" else "-"
+        
+        return (
+            f"📢 <b>Broadcast {state['status']}</b>\n"
+            f"📊 Progress: {done:,}/{total:,} ({done * 100 // total}%)\n"
+            f"✅ Success: {state['success']:,}\n"
+            f"❌ Failed: {state['failed']:,}\n"
+            f"🚫 Skipped: {state['skipped']:,}\n"
+            f"⚡ Rate: {rate:.1f} msg/s • ETA: {eta}"
+        )
+
+    async def _checkpoint(self, state: Dict):
+        state["updated_at"] = datetime.now()
+        await broadcasts_collection.update_one(
+            {"_id": state["_id"]},
+            {"$set": {key: value for key, value in state.items() if key != "_id"}}
+        )
+
+    async def _report(self, progress_message: Message):
+        try:
+            await progress_message.edit_text(self.progress_text())
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.error(f"Error updating broadcast progress: {e}")
+
+    async def _send(self, client: Client, state: Dict, user_id: int) -> bool:
+        """Forward the broadcast message to one user, retrying after FloodWait"""
+        for _ in range(3):
+            await self.limiter.acquire()
+            try:
+                await client.forward_messages(user_id, state["from_chat_id"], state["message_id"])
+                return True
+            except FloodWait as e:
+                logger.warning(f"Broadcast FloodWait: pausing all senders for {e.value}s")
+                self.limiter.pause(e.value)
+            except (UserIsBlocked, InputUserDeactivated, PeerIdInvalid):
+                return False
+            except Exception as e:
+                logger.error(f"Error broadcasting to user {user_id}: {e}")
+                return False
+        return False
+
+    async def _send_batch(self, client: Client, state: Dict, user_ids: List[int]):
+        """Send to a batch of users with a pool of concurrent senders, advancing the watermark"""
+        pending = iter(enumerate(user_ids))
+        outcomes: Dict[int, str] = {}
+        watermark = 0
+        
+        async def sender():
+            nonlocal watermark
+            for index, user_id in pending:
+                if await is_banned(user_id):
+                    outcomes[index] = "skipped"
+                elif await self._send(client, state, user_id):
+                    outcomes[index] = "success"
+                else:
+                    outcomes[index] = "failed"
+                self._run_processed += 1
+                # Senders finish out of order; only a contiguous prefix of the batch is counted
+                while watermark in outcomes:
+                    state[outcomes.pop(watermark)] += 1
+                    state["last_user_id"] = user_ids[watermark]
+                    watermark += 1
+        
+        await asyncio.gather(*(sender() for _ in range(min(self.concurrency, len(user_ids)))))
+
+    async def _run(self, client: Client, state: Dict, progress_message: Message):
+        last_report = 0.0
+        try:
+            while True:
+                query = {} if state["last_user_id"] is None else {"user_id": {"$gt": state["last_user_id"]}}
+                cursor = users_collection.find(query, {"user_id": 1, "_id": 0}).sort("user_id", 1).limit(self.batch_size)
+                user_ids = [doc["user_id"] async for doc in cursor]
+                if not user_ids:
+                    break
+                
+                await self._send_batch(client, state, user_ids)
+                await self._checkpoint(state)
+                
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    await self._report(progress_message)
+            
+            state["status"] = "completed"
+        except asyncio.CancelledError:
+            state["status"] = "cancelled" if self._cancelled else "interrupted"
+        except Exception as e:
+            state["status"] = "interrupted"
+            logger.error(f"Broadcast stopped by error: {e}")
+        
+        try:
+            await self._checkpoint(state)
+        except Exception as e:
+            logger.error(f"Error saving broadcast checkpoint: {e}")
+        await self._report(progress_message)
+        logger.info(f"Broadcast {state['_id']} {state['status']}: "
+                    f"{state['success']} sent, {state['failed']} failed, {state['skipped']} skipped")
+
+broadcast_engine = BroadcastEngine(
+    concurrency=BROADCAST_CONCURRENCY,
+    rate=BROADCAST_RATE,
+    batch_size=BROADCAST_BATCH_SIZE,
+    progress_interval=BROADCAST_PROGRESS_INTERVAL
+)
+
+# Statistics counters
+def format_size(num_bytes: int) -> str:
+    """Format a byte count for display"""
+    size = float(num_bytes)
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+class StatsCounters:
+    """Collection counters maintained in memory for /about and /status.
+
+    The ingest, ban and user-registration paths adjust the counters as they
+    write. Totals are reconciled with estimated_document_count every
+    STATS_RECONCILE_INTERVAL seconds. Per-type file counts and bytes come from
+    an aggregation that runs every STATS_TYPE_RECONCILE_INTERVAL seconds; its
+    result is stored in settings_collection and saved files are $inc'ed into
+    it, so a restart reads current counts without repeating the aggregation.
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.files = 0
+        self.banned = 0
+        self.file_types: Dict[str, Dict[str, int]] = {}
+        self.types_updated_at: Optional[datetime] = None
+
+    async def files_added(self, docs: List[Dict]):
+        """Count newly saved files in memory and in the stored per-type snapshot"""
+        increments = {}
+        for doc in docs:
+            self.files += 1
+            entry = self.file_types.setdefault(doc["file_type"], {"count": 0, "bytes": 0})
+            entry["count"] += 1
+            entry["bytes"] += doc["file_size"] or 0
+            count_key, bytes_key = f"file_types.{doc['file_type']}.count", f"file_types.{doc['file_type']}.bytes"
+            increments[count_key] = increments.get(count_key, 0) + 1
+            increments[bytes_key] = increments.get(bytes_key, 0) + (doc["file_size"] or 0)
+        if increments:
+            await settings_collection.update_one({"_id": "file_stats"}, {"$inc": increments})
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self.file_types.values())
+
+    async def reconcile_counts(self):
+        """Reset the totals from the collection metadata"""
+        self.users = await stats_db.users.estimated_document_count()
+        self.files = await stats_db.files.estimated_document_count()
+        self.banned = await stats_db.banned_users.estimated_document_count()
+
+    async def reconcile_types(self):
+        """Recompute per-type counts and bytes and store the snapshot"""
+        file_types = {}
+        pipeline = [{"$group": {"_id": "$file_type", "count": {"$sum": 1}, "bytes": {"$sum": "$file_size"}}}]
+        async for row in stats_db.files.aggregate(pipeline, allowDiskUse=True):
+            file_types[row["_id"] or "unknown"] = {"count": row["count"], "bytes": row["bytes"]}
+        
+        self.file_types = file_types
+        self.types_updated_at = datetime.now()
+        await settings_collection.update_one(
+            {"_id": "file_stats"},
+            {"$set": {"file_types": file_types, "updated_at": self.types_updated_at}},
+            upsert=True
+        )
+
+    async def load(self):
+        """Load counters at startup, reusing the stored per-type snapshot if there is one"""
+        await self.reconcile_counts()
+        snapshot = await settings_collection.find_one({"_id": "file_stats"})
+        if snapshot is None:
+            await self.reconcile_types()
+        else:
+            self.file_types = snapshot["file_types"]
+            self.types_updated_at = snapshot["updated_at"]
+
+stats = StatsCounters()
+
+# Background tasks
+background_tasks: List[asyncio.Task] = []
+
+async def run_periodically(interval: int, func, name: str):
+    """Run a coroutine function every `interval` seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await func()
+        except Exception as e:
+            logger.error(f"Error in periodic task {name}: {e}")
+
+def start_background_task(coro):
+    """Schedule a coroutine that lives as long as the bot"""
+    background_tasks.append(asyncio.create_task(coro))
+
+async def stop_background_tasks():
+    """Cancel every background task and wait for it to finish"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+# Chat admin cache
+ADMIN_STATUSES = [enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER]
+
+class AdminCache:
+    """Per-chat admin lists with a TTL, refreshed by chat_member updates.
+
+    The first check in a chat fetches its whole administrator list once, so
+    regular members of busy groups never cost an API call. Chats whose list
+    can't be read fall back to cached per-(chat, user) get_chat_member answers.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._chats: Dict[int, tuple] = {}
+        self._members: Dict[tuple, tuple] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.lookups = 0
+
+    async def _fetch_admins(self, chat_id: int) -> Optional[set]:
+        try:
+            admins = set()
+            async for member in app.get_chat_members(chat_id, filter=enums.ChatMembersFilter.ADMINISTRATORS):
+                admins.add(member.user.id)
+            self._chats[chat_id] = (time.monotonic() + self.ttl, admins)
+            return admins
+        except Exception as e:
+            logger.warning(f"Could not read admin list of {chat_id}: {e}")
+            self._chats[chat_id] = (time.monotonic() + self.ttl, None)
+            return None
+        finally:
+            self._loading.pop(chat_id, None)
+
+    async def _chat_admins(self, chat_id: int) -> Optional[set]:
+        entry = self._chats.get(chat_id)
+        if entry is not None and entry[0] >= time.monotonic():
+            return entry[1]
+        # Share one fetch between concurrent checks in the same chat
+        task = self._loading.get(chat_id)
+        if task is None:
+            task = self._loading[chat_id] = asyncio.create_task(self._fetch_admins(chat_id))
+        return await asyncio.shield(task)
+
+    async def is_admin(self, user_id: int, chat_id: int) -> bool:
+        admins = await self._chat_admins(chat_id)
+        if admins is not None:
+            self.hits += 1
+            return user_id in admins
+        
+        key = (chat_id, user_id)
+        entry = self._members.get(key)
+        if entry is not None and entry[0] >= time.monotonic():
+            self.hits += 1
+            return entry[1]
+        
+        self.lookups += 1
+        try:
+            member = await app.get_chat_member(chat_id, user_id)
+            result = member.status in ADMIN_STATUSES
+        except Exception:
+            result = False
+        self._members[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    def update(self, chat_id: int, user_id: int, is_admin: bool):
+        """Apply a chat_member update to the cached lists"""
+        entry = self._chats.get(chat_id)
+        if entry is not None and entry[1] is not None:
+            if is_admin:
+                entry[1].add(user_id)
+            else:
+                entry[1].discard(user_id)
+        if (chat_id, user_id) in self._members:
+            self._members[(chat_id, user_id)] = (time.monotonic() + self.ttl, is_admin)
+
+    async def prefill(self):
+        """Load the admin lists of every known group"""
+        count = 0
+        try:
+            async for group in groups_collection.find({}, {"group_id": 1, "_id": 0}):
+                if await self._chat_admins(group["group_id"]) is not None:
+                    count += 1
+        except Exception as e:
+            logger.error(f"Error prefilling admin cache: {e}")
+        logger.info(f"Admin cache prefilled for {count} groups")
+
+admin_cache = AdminCache(ttl=ADMIN_CACHE_TTL)
+
+# Ingest pipeline
+class IngestPipeline:
+    """Bounded queue between index_file and the database.
+
+    index_file only extracts metadata and enqueues it. A single consumer
+    collects up to INGEST_BATCH_SIZE items (or whatever arrived within
+    INGEST_FLUSH_INTERVAL seconds), checks admin rights for non-source
+    uploads, keeps the last copy of each file_id and writes the batch with
+    one FileDocument.bulk_save. When the queue is full, index_file waits,
+    which pushes back on the update workers.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self.enqueued = 0
+        self.indexed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.failed = 0
+        self.backpressure_waits = 0
+        self.last_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Create the queue and start the consumer on the running loop"""
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        start_background_task(self._consume())
+
+    async def put(self, file_doc: "FileDocument", trusted: bool, user_id: Optional[int], chat_id: int):
+        """Queue a file for indexing, waiting if the queue is full"""
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put((file_doc, trusted, user_id, chat_id))
+        self.enqueued += 1
+
+    async def _consume(self):
+        batch = []
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._flush(batch)
+                batch = []
+        except asyncio.CancelledError:
+            # Shutting down: write what has been accepted so far
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch:
+                await self._flush(batch)
+            raise
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            needs_check = [item for item in batch if not item[1]]
+            allowed = await asyncio.gather(*(is_admin(user_id, chat_id) for _, _, user_id, chat_id in needs_check))
+            rejected = {id(item) for item, ok in zip(needs_check, allowed) if not ok}
+            self.rejected += len(rejected)
+            
+            # Collapse reposts of the same file in the batch into one document
+            unique: Dict[str, FileDocument] = {}
+            for item in batch:
+                if id(item) in rejected:
+                    continue
+                file_doc = item[0]
+                keys = [file_doc.content_key, file_doc.file_unique_id or file_doc.content_key]
+                canonical = unique.get(keys[0]) or unique.get(keys[1])
+                if canonical is not None:
+                    canonical.merge_sources(file_doc)
+                else:
+                    for key in keys:
+                        unique[key] = file_doc
+            file_docs = list({id(file_doc): file_doc for file_doc in unique.values()}.values())
+            self.duplicates += len(batch) - len(rejected) - len(file_docs)
+            
+            written = await FileDocument.bulk_save(file_docs)
+            self.indexed += written
+            self.failed += len(file_docs) - written
+            if written:
+                logger.info(f"Indexed {written} files ({len(rejected)} rejected, {self.depth} queued)")
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Error indexing batch of {len(batch)} files: {e}")
+        finally:
+            self.last_flush_latency = time.perf_counter() - started
+
+ingest_pipeline = IngestPipeline(
+    max_size=INGEST_QUEUE_SIZE,
+    batch_size=INGEST_BATCH_SIZE,
+    flush_interval=INGEST_FLUSH_INTERVAL
+)
+
 # Helper functions
 async def is_admin(user_id: int, chat_id: int = None) -> bool:
     """Check if user is admin or owner"""
     if user_id == OWNER_ID:
         return True
     
-    if chat_id:
-        try:
-            member = await app.get_chat_member(chat_id, user_id)
-            return member.status in [enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER]
-        except:
-            return False
+    if chat_id and user_id:
+        return await admin_cache.is_admin(user_id, chat_id)
     
     return False
 
 async def is_banned(user_id: int) -> bool:
     """Check if user is banned"""
-    banned_user = await banned_collection.find_one({"user_id": user_id})
-    return banned_user is not None
+    return await banned_users.contains(user_id)
 
-async def check_user_subscription(user_id: int) -> bool:
+async def check_user_subscription(user_id: int, refresh: bool = False) -> bool:
     """Check if user is subscribed to required channel"""
+    cached = membership_mirror.get(user_id)
+    if cached or (cached is False and not refresh):
+        return cached
+    
     try:
         member = await app.get_chat_member(REQUIRED_CHANNEL, user_id)
-        return member.status not in [enums.ChatMemberStatus.LEFT, enums.ChatMemberStatus.KICKED]
-    except:
+        is_member = member.status not in [enums.ChatMemberStatus.LEFT, enums.ChatMemberStatus.BANNED]
+    except UserNotParticipant:
+        is_member = False
+    except Exception as e:
+        # Transient errors (FloodWait, network) are not cached
+        logger.error(f"Error checking subscription of {user_id}: {e}")
         return False
+    
+    membership_mirror.remember(user_id, is_member)
+    return is_member
 
 async def add_user(user_id: int, username: str = None, first_name: str = None):
-    """Add user to database"""
-    try:
-        await users_collection.update_one(
-            {"user_id": user_id},
-            {
-                "$set": {
-                    "user_id": user_id,
-                    "username": username,
-                    "first_name": first_name,
-                    "joined_at": datetime.now(),
-                    "last_active": datetime.now()
-                }
-            },
-            upsert=True
-        )
-    except Exception as e:
-        logger.error(f"Error adding user {user_id}: {e}")
+    """Add user to database (buffered, see UserActivityBuffer)"""
+    user_activity.record(user_id, username, first_name)
 
 async def get_user_count() -> int:
     """Get total user count"""
-    return await users_collection.count_documents({})
+    return stats.users
 
 async def get_file_count() -> int:
     """Get total file count"""
-    return await files_collection.count_documents({})
+    return stats.files
 
 async def get_banned_count() -> int:
     """Get total banned user count"""
-    return await banned_collection.count_documents({})
+    return stats.banned
 
 async def get_uptime() -> str:
     """Get bot uptime"""
@@ -159,83 +1559,1284 @@ async def get_uptime() -> str:
     else:
         return f"{seconds}s"
 
+# Search keys
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_EXTENSION_RE = re.compile(r"\.(mkv|mp4|avi|mov|wmv|flv|webm|m4v|ts|mp3|flac|m4a|aac|ogg|opus|wav|zip|rar|7z|pdf|epub|srt|apk|iso)$", re.IGNORECASE)
+_YEAR_RE = re.compile(r"^(19[3-9]\d|20\d{2})$")
+_RESOLUTION_RE = re.compile(r"^(240|360|480|540|576|720|1080|1440|2160|4320)p$")
+_EPISODE_RE = re.compile(r"^s(\d{1,2})(?:e(\d{1,3}))?$|^e(?:p)?(\d{1,3})$")
+
+RESOLUTION_ALIASES = {"4k": "2160p", "uhd": "2160p", "fhd": "1080p", "hd": "720p", "8k": "4320p"}
+LANGUAGE_ALIASES = {
+    "english": "english", "eng": "english",
+    "hindi": "hindi", "hin": "hindi",
+    "tamil": "tamil", "tam": "tamil",
+    "telugu": "telugu", "tel": "telugu",
+    "malayalam": "malayalam", "mal": "malayalam",
+    "kannada": "kannada", "kan": "kannada",
+    "bengali": "bengali", "ben": "bengali",
+    "marathi": "marathi", "punjabi": "punjabi", "urdu": "urdu",
+    "korean": "korean", "kor": "korean",
+    "japanese": "japanese", "jap": "japanese", "jpn": "japanese",
+    "chinese": "chinese", "spanish": "spanish", "french": "french",
+    "german": "german", "italian": "italian", "russian": "russian",
+}
+
+def normalize_text(text: str) -> str:
+    """Lowercase text and fold punctuation, dots and underscores into single spaces"""
+    return " ".join(_TOKEN_RE.findall((text or "").lower()))
+
+def parse_file_name(file_name: str) -> Dict[str, Any]:
+    """Extract the normalized name, clean title and release attributes of a file name.
+
+    "Movie.Name.2021.1080p.WEB-DL.x264.mkv" gives normalized_name
+    "movie name 2021 1080p web dl x264", title "movie name", year 2021 and
+    resolution "1080p". The title is everything before the first attribute.
+    """
+    normalized_name = normalize_text(_EXTENSION_RE.sub("", file_name or ""))
+    words = normalized_name.split()
+    
+    fields = {
+        "normalized_name": normalized_name,
+        "title": normalized_name,
+        "year": None,
+        "resolution": None,
+        "season": None,
+        "episode": None,
+        "languages": []
+    }
+    title_end = None
+    for i, word in enumerate(words):
+        is_attribute = True
+        episode = _EPISODE_RE.match(word)
+        if _YEAR_RE.match(word) and i > 0:
+            fields["year"] = fields["year"] or int(word)
+        elif _RESOLUTION_RE.match(word) or word in RESOLUTION_ALIASES:
+            fields["resolution"] = fields["resolution"] or RESOLUTION_ALIASES.get(word, word)
+        elif episode:
+            season, episode_number, bare_episode = episode.groups()
+            if season:
+                fields["season"] = int(season)
+            if episode_number or bare_episode:
+                fields["episode"] = int(episode_number or bare_episode)
+        elif word in LANGUAGE_ALIASES:
+            language = LANGUAGE_ALIASES[word]
+            if language not in fields["languages"]:
+                fields["languages"].append(language)
+        else:
+            is_attribute = False
+        if is_attribute and title_end is None:
+            title_end = i
+    
+    if title_end:
+        fields["title"] = " ".join(words[:title_end])
+    return fields
+
+def document_fields(doc: Dict) -> tuple:
+    """Split a file document into name terms and caption terms (caption without branding)"""
+    caption = doc.get("caption") or ""
+    if BRANDING_TAG:
+        caption = caption.replace(BRANDING_TAG, "")
+    return normalize_text(doc.get("file_name")).split(), normalize_text(caption).split()
+
+def document_terms(doc: Dict) -> set:
+    """Extract the searchable terms of a file document"""
+    name_terms, caption_terms = document_fields(doc)
+    return set(name_terms) | set(caption_terms)
+
+def search_keys(file_name: str, caption: str) -> Dict[str, Any]:
+    """Return the precomputed search fields stored on every file document"""
+    return {
+        **parse_file_name(file_name),
+        "tokens": sorted(document_terms({"file_name": file_name, "caption": caption}))
+    }
+
+async def dedupe_files(batch_size: int = 1000) -> tuple:
+    """Collapse duplicate files already stored, returning (groups, deleted).
+
+    A streaming aggregation groups documents by content_key (computed from
+    file_size and normalized_name for documents stored before it existed),
+    oldest first. The oldest document of each group stays canonical and
+    absorbs the others' sources and download counts; the rest are deleted
+    in batches.
+    """
+    pipeline = [
+        {"$match": {"$or": [{"content_key": {"$exists": True}}, {"normalized_name": {"$exists": True}}]}},
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"$ifNull": ["$content_key", {"$concat": [{"$toString": "$file_size"}, ":", "$normalized_name"]}]},
+            "ids": {"$push": "$_id"},
+            "file_ids": {"$push": "$file_id"},
+            "group_ids": {"$push": "$group_id"},
+            "sources": {"$push": {"$ifNull": ["$sources", []]}},
+            "downloads": {"$push": {"$ifNull": ["$download_count", 0]}},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    
+    groups = deleted = 0
+    delete_ids, deleted_file_ids, updates = [], [], []
+    
+    async def flush():
+        nonlocal deleted
+        if updates:
+            await files_collection.bulk_write(updates, ordered=False)
+        if delete_ids:
+            result = await files_collection.delete_many({"_id": {"$in": delete_ids}})
+            deleted += result.deleted_count
+        for file_id in deleted_file_ids:
+            search_index.remove(file_id)
+            search_workers.remove(file_id)
+            render_cache.discard(file_id)
+            featured_files.remove(file_id)
+        delete_ids.clear()
+        deleted_file_ids.clear()
+        updates.clear()
+    
+    async for group in files_collection.aggregate(pipeline, allowDiskUse=True):
+        groups += 1
+        sources = []
+        for i, file_id in enumerate(group["file_ids"]):
+            for source in group["sources"][i] or [{"chat_id": group["group_ids"][i], "message_id": None, "file_id": file_id}]:
+                if source not in sources:
+                    sources.append(source)
+        
+        updates.append(UpdateOne(
+            {"_id": group["ids"][0]},
+            {
+                "$set": {"content_key": group["_id"]},
+                "$addToSet": {"sources": {"$each": sources}},
+                "$inc": {"download_count": sum(group["downloads"][1:])}
+            }
+        ))
+        delete_ids.extend(group["ids"][1:])
+        deleted_file_ids.extend(group["file_ids"][1:])
+        if len(delete_ids) >= batch_size:
+            await flush()
+    
+    await flush()
+    query_cache.clear()
+    if deleted:
+        await stats.reconcile_counts()
+        await stats.reconcile_types()
+    return groups, deleted
+
+async def migrate_search_keys(batch_size: int = 1000) -> int:
+    """Backfill search keys on documents stored before they existed, in batches"""
+    migrated = 0
+    last_id = None
+    while True:
+        query = {"tokens": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        cursor = files_collection.find(query, {"file_name": 1, "caption": 1, "file_size": 1}).sort("_id", 1).limit(batch_size)
+        docs = [doc async for doc in cursor]
+        if not docs:
+            break
+        
+        operations = []
+        for doc in docs:
+            keys = search_keys(doc.get("file_name"), doc.get("caption"))
+            keys["content_key"] = f"{doc.get('file_size') or 0}:{keys['normalized_name']}"
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": keys}))
+        await files_collection.bulk_write(operations, ordered=False)
+        migrated += len(docs)
+        last_id = docs[-1]["_id"]
+        logger.info(f"Search key migration: {migrated:,} documents updated")
+    return migrated
+
+# In-memory search index
+def _trigrams(term: str) -> set:
+    """Return the set of 3-character grams of a term"""
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+def _deletes(term: str, distance: int) -> set:
+    """Return every string reachable from a term by deleting up to `distance` characters"""
+    results = set()
+    frontier = {term}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        results |= frontier
+    return results
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+class SearchIndex:
+    """Ranked token/trigram inverted index over files_collection, answered from memory.
+
+    Every document is split into normalized name and caption tokens (the
+    caption without the branding tag). Postings map each token to the
+    documents containing it with a term frequency in which name occurrences
+    count SEARCH_NAME_BOOST times. A query matches when each of its words
+    resolves to some token of the document: the word itself, a longer token
+    containing it (partial typing), or - when neither exists - a token within
+    SEARCH_MAX_EDIT_DISTANCE edits found through a SymSpell-style deletion
+    dictionary. Matches are ranked with BM25; each term's postings are walked
+    in impact order so a query stops as soon as no unseen document can enter
+    the requested page.
+
+    MongoDB stays the source of truth; the index is rebuilt from it at
+    startup and kept current by FileDocument.bulk_save.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    PARTIAL_WEIGHT = 0.7
+    TYPO_WEIGHT = 0.5
+    TYPO_MIN_LENGTH = 4
+    IMPACT_DRIFT = 1.1
+    PRUNE_MIN_POSTINGS = 1000
+
+    def __init__(self, name_boost: float = 3.0, max_edit_distance: int = 2, max_expansions: int = 50):
+        self.name_boost = name_boost
+        self.max_edit_distance = max_edit_distance
+        self.max_expansions = max_expansions
+        self.clear()
+
+    def clear(self):
+        """Drop every document and mark the index as not loaded"""
+        self.loaded = False
+        self.docs: Dict[int, Dict] = {}
+        self._seq_by_file_id: Dict[str, int] = {}
+        self._terms_by_seq: Dict[int, list] = {}
+        self._lengths: Dict[int, float] = {}
+        self._total_length = 0.0
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._impacts: Dict[str, tuple] = {}
+        self._gram_terms: Dict[str, set] = {}
+        self._delete_terms: Dict[str, set] = {}
+        self._vocab: List[str] = []
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _typo_distance(self, term: str) -> int:
+        """Edit distance tolerated for a term: none for short words and numbers, 1 up to 7 characters"""
+        if len(term) < self.TYPO_MIN_LENGTH or term.isdigit():
+            return 0
+        return min(self.max_edit_distance, 1 if len(term) < 8 else 2)
+
+    def add(self, doc: Dict):
+        """Add or replace a document in the index"""
+        file_id = doc["file_id"]
+        seq = self._seq_by_file_id.get(file_id)
+        if seq is not None:
+            previous = self.docs[seq]
+            if "_id" not in doc and "_id" in previous:
+                doc = {**doc, "_id": previous["_id"]}
+            self._unlink(seq)
+        else:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seq_by_file_id[file_id] = seq
+
+        name_terms, caption_terms = document_fields(doc)
+        frequencies: Dict[str, float] = {}
+        for term in name_terms:
+            frequencies[term] = frequencies.get(term, 0.0) + self.name_boost
+        for term in caption_terms:
+            frequencies[term] = frequencies.get(term, 0.0) + 1.0
+        length = len(name_terms) * self.name_boost + len(caption_terms)
+
+        self.docs[seq] = doc
+        self._terms_by_seq[seq] = list(frequencies)
+        self._lengths[seq] = length
+        self._total_length += length
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._link_term(term)
+            postings[seq] = frequency
+            self._impacts.pop(term, None)
+
+    def _link_term(self, term: str):
+        """Register a new vocabulary term in the prefix, trigram and deletion maps"""
+        insort(self._vocab, term)
+        for gram in _trigrams(term):
+            self._gram_terms.setdefault(gram, set()).add(term)
+        for deleted in _deletes(term, self._typo_distance(term)):
+            self._delete_terms.setdefault(deleted, set()).add(term)
+
+    def _unlink_term(self, term: str):
+        """Remove a vocabulary term that no document uses any more"""
+        self._vocab.pop(bisect_left(self._vocab, term))
+        for key, index in ((gram, self._gram_terms) for gram in _trigrams(term)):
+            self._discard(index, key, term)
+        for deleted in _deletes(term, self._typo_distance(term)):
+            self._discard(self._delete_terms, deleted, term)
+
+    @staticmethod
+    def _discard(index: Dict[str, set], key: str, term: str):
+        terms = index.get(key)
+        if terms is not None:
+            terms.discard(term)
+            if not terms:
+                del index[key]
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        """Return the indexed document of a file_id"""
+        seq = self._seq_by_file_id.get(file_id)
+        return None if seq is None else self.docs[seq]
+
+    def remove(self, file_id: str):
+        """Drop a document from the index"""
+        seq = self._seq_by_file_id.pop(file_id, None)
+        if seq is None:
+            return
+        self._unlink(seq)
+        del self.docs[seq]
+
+    def _unlink(self, seq: int):
+        """Remove a document's terms from the posting lists"""
+        self._total_length -= self._lengths.pop(seq, 0.0)
+        for term in self._terms_by_seq.pop(seq, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(seq, None)
+            self._impacts.pop(term, None)
+            if not postings:
+                del self._postings[term]
+                self._unlink_term(term)
+
+    def _matching_terms(self, fragment: str) -> set:
+        """Return vocabulary terms containing the fragment"""
+        if len(fragment) < 3:
+            # Too short for trigrams: fall back to a prefix walk over the sorted vocabulary
+            terms = set()
+            i = bisect_left(self._vocab, fragment)
+            while i < len(self._vocab) and self._vocab[i].startswith(fragment):
+                terms.add(self._vocab[i])
+                i += 1
+            return terms
+
+        gram_sets = sorted((self._gram_terms.get(g, set()) for g in _trigrams(fragment)), key=len)
+        if not gram_sets[0]:
+            return set()
+        candidates = gram_sets[0].intersection(*gram_sets[1:])
+        return {term for term in candidates if fragment in term}
+
+    def _typo_terms(self, fragment: str) -> set:
+        """Return vocabulary terms within the tolerated edit distance of a misspelled word"""
+        distance = self._typo_distance(fragment)
+        if not distance:
+            return set()
+        candidates = set(self._delete_terms.get(fragment, ()))
+        for deleted in _deletes(fragment, distance) | {fragment}:
+            if deleted in self._postings:
+                candidates.add(deleted)
+            candidates |= self._delete_terms.get(deleted, set())
+        return {term for term in candidates if edit_distance(fragment, term, distance) <= distance}
+
+    def _expand(self, fragment: str) -> Dict[str, float]:
+        """Map a query word to the vocabulary terms it matches and their weight"""
+        expansions = {}
+        partial = sorted(self._matching_terms(fragment) - {fragment}, key=len)[:self.max_expansions]
+        for term in partial:
+            expansions[term] = self.PARTIAL_WEIGHT
+        if fragment in self._postings:
+            expansions[fragment] = 1.0
+        if not expansions:
+            for term in self._typo_terms(fragment):
+                expansions[term] = self.TYPO_WEIGHT
+        return expansions
+
+    def _impact(self, frequency: float, seq: int, average_length: float) -> float:
+        """BM25 term-frequency part of a posting's score, before the weight * idf factor"""
+        norm = self.K1 * (1 - self.B + self.B * self._lengths[seq] / average_length)
+        return frequency * (self.K1 + 1) / (frequency + norm)
+
+    def _impact_order(self, term: str, average_length: float) -> tuple:
+        """Return (average length used, seqs sorted by impact) for a term, newest first on ties.
+
+        The order is cached until the term's postings change or the average
+        document length drifts more than IMPACT_DRIFT away from the one it was
+        sorted with.
+        """
+        cached = self._impacts.get(term)
+        if cached is None or not 1 / self.IMPACT_DRIFT <= average_length / cached[0] <= self.IMPACT_DRIFT:
+            postings = self._postings[term]
+            lengths, k1, b = self._lengths, self.K1, self.B
+            # Same arithmetic as _impact, inlined: this sorts every posting of the term.
+            # A stable sort of descending seqs leaves ties newest first.
+            order = sorted(
+                sorted(postings, reverse=True),
+                key=lambda seq: postings[seq] * (k1 + 1) / (postings[seq] + k1 * (1 - b + b * lengths[seq] / average_length)),
+                reverse=True
+            )
+            cached = self._impacts[term] = (average_length, order)
+        return cached
+
+    def _run_end(self, postings: Dict[int, float], order: list, start: int, sorted_length: float) -> int:
+        """Return the position just past the run of postings sharing order[start]'s impact"""
+        impact = self._impact(postings[order[start]], order[start], sorted_length)
+        low, high = start + 1, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._impact(postings[order[middle]], order[middle], sorted_length) < impact:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _fragment_score(self, weighted: list, seq: int, average_length: float) -> float:
+        """BM25 score of one query word for one document, best expansion wins; 0 when none matches"""
+        best = 0.0
+        for _, postings, coefficient in weighted:
+            frequency = postings.get(seq)
+            if frequency:
+                score = coefficient * self._impact(frequency, seq, average_length)
+                if score > best:
+                    best = score
+        return best
+
+    def search(self, query: str, limit: int = 10, after: Optional[tuple] = None) -> List[Dict]:
+        """Return up to `limit` documents matching every word of the query, best first.
+
+        Results carry a "score" field. `after` is a decoded (score, _id)
+        pagination cursor; only documents ranked below it are returned.
+        Empty queries list the newest documents.
+        """
+        fragments = list(dict.fromkeys(normalize_text(query).split()))
+        if not fragments:
+            # Sequence numbers follow _id order, so walking the dict backwards is newest first
+            docs = reversed(self.docs.values())
+            if after is not None:
+                docs = (doc for doc in docs if doc["_id"] < after[1])
+            return list(islice(docs, limit))
+
+        expansions = [self._expand(fragment) for fragment in fragments]
+        if not all(expansions) or limit < 1:
+            return []
+
+        # Score from the most selective word's postings; past PRUNE_MIN_POSTINGS
+        # they are walked in impact order and the walk stops once its next upper
+        # bound plus the other words' best possible scores cannot reach the page
+        expansions.sort(key=lambda terms: sum(len(self._postings[term]) for term in terms))
+        total_docs = len(self.docs)
+        average_length = self._total_length / total_docs
+        words = []
+        for terms in expansions:
+            weighted = []
+            for term, weight in terms.items():
+                postings = self._postings[term]
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                weighted.append((term, postings, weight * idf))
+            words.append(weighted)
+        if sum(len(postings) for _, postings, _ in words[0]) <= self.PRUNE_MIN_POSTINGS:
+            # Few candidates: scoring them all is cheaper than ordering the postings
+            candidates = set().union(*(postings for _, postings, _ in words[0]))
+            ranked = (self._rank_item(words, seq, average_length) for seq in candidates)
+            ranked = (item for item in ranked if item is not None and (after is None or item[:2] < after))
+            return self._results(heapq.nlargest(limit, ranked))
+    
+        # The term-frequency part of BM25 never reaches K1 + 1
+        others = sum(max(coefficient for _, _, coefficient in weighted) for weighted in words[1:]) * (self.K1 + 1)
+        stream = []
+        for term, postings, coefficient in words[0]:
+            sorted_length, order = self._impact_order(term, average_length)
+            # A larger average shortens every normalized length, raising scores by at most the ratio
+            bound = coefficient * max(1.0, average_length / sorted_length)
+            upper = bound * self._impact(postings[order[0]], order[0], sorted_length)
+            stream.append((-upper, len(stream), [postings, order, 0, bound, sorted_length]))
+        heapq.heapify(stream)
+    
+        top: list = []
+        seen = set()
+        while stream:
+            _, slot, cursor = stream[0]
+            postings, order, index, bound, sorted_length = cursor
+            seq = order[index]
+            skip = False
+            if len(top) == limit:
+                ceiling = round(others - stream[0][0], 4)
+                if top[0][0] > ceiling:
+                    break
+                # The ceiling ties the page floor: the rest of this run of equal impacts can
+                # only tie it too, and its older sequence numbers (so _ids) rank below it
+                skip = top[0][0] == ceiling and seq < top[0][2]
+            cursor[2] = index = self._run_end(postings, order, index, sorted_length) if skip else index + 1
+            if index < len(order):
+                upper = bound * self._impact(postings[order[index]], order[index], sorted_length)
+                heapq.heapreplace(stream, (-upper, slot, cursor))
+            else:
+                heapq.heappop(stream)
+            if skip or seq in seen:
+                continue
+            seen.add(seq)
+            item = self._rank_item(words, seq, average_length)
+            if item is None or (after is not None and item[:2] >= after):
+                continue
+            if len(top) < limit:
+                heapq.heappush(top, item)
+            elif item > top[0]:
+                heapq.heapreplace(top, item)
+        return self._results(sorted(top, reverse=True))
+
+    def _rank_item(self, words: list, seq: int, average_length: float) -> Optional[tuple]:
+        """Return the (rounded score, _id, seq) ranking key of a document matching every word, else None"""
+        total = 0.0
+        for weighted in words:
+            score = self._fragment_score(weighted, seq, average_length)
+            if not score:
+                return None
+            total += score
+        return (round(total, 4), self.docs[seq]["_id"], seq)
+
+    def _results(self, ranked: list) -> List[Dict]:
+        return [{**self.docs[seq], "score": score} for score, _, seq in ranked]
+
+    async def load(self):
+        """Build the index from files_collection"""
+        started = time.time()
+        self.clear()
+        projection = {"sources": 0, "tokens": 0}
+        async for doc in search_files_collection.find({}, projection).sort("_id", 1).batch_size(5000):
+            self.add(doc)
+        self.loaded = True
+        logger.info(f"Search index loaded: {len(self.docs):,} files, "
+                    f"{len(self._postings):,} terms in {time.time() - started:.2f}s")
+
+search_index = SearchIndex(
+    name_boost=SEARCH_NAME_BOOST,
+    max_edit_distance=SEARCH_MAX_EDIT_DISTANCE,
+    max_expansions=SEARCH_MAX_EXPANSIONS
+)
+
+# Search worker processes
+def _search_worker(index: SearchIndex, requests, responses: multiprocessing.connection.Connection):
+    """Worker process loop: apply index updates and answer searches with (file_id, score) pairs"""
+    # Ctrl+C reaches the whole process group; the parent stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        message = requests.get()
+        if message is None:
+            return
+        kind = message[0]
+        if kind == "add":
+            index.add(message[1])
+        elif kind == "remove":
+            index.remove(message[1])
+        elif kind == "search":
+            _, request_id, query, limit, after = message
+            try:
+                hits = [(doc["file_id"], doc.get("score", 0.0)) for doc in index.search(query, limit, after)]
+                responses.send((request_id, hits, None))
+            except Exception as e:
+                responses.send((request_id, None, repr(e)))
+
+class SearchWorkerPool:
+    """Worker processes holding read-only copies of the search index.
+
+    Workers are forked after search_index has loaded, so each starts with
+    the parent's index, and every later add/remove is pushed to all of them
+    in order. A query goes to the worker with the fewest outstanding
+    requests and comes back as ranked file_ids, which are mapped to the
+    parent's documents. Ranking therefore never blocks the event loop, and
+    concurrent queries use as many cores as there are workers. A worker
+    that errors or exceeds SEARCH_WORKER_TIMEOUT is answered in-process, and
+    a worker found dead is replaced by a fresh fork of the current index
+    before anything is sent to it.
+    """
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._processes = []
+        self._requests = []
+        self._outstanding: List[int] = []
+        self._readers: list = []
+        self._collecting = False
+        self._futures: Dict[int, tuple] = {}
+        self._next_request = 0
+        self._collector: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._context = None
+        self._index: Optional[SearchIndex] = None
+        self.queries = 0
+        self.fallbacks = 0
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._processes)
+
+    @property
+    def workers(self) -> int:
+        return len(self._processes)
+
+    def start(self, index: SearchIndex):
+        """Fork the workers from the loaded index"""
+        if not self.size or self.running:
+            return
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        self._loop = asyncio.get_running_loop()
+        self._index = index
+        for _ in range(self.size):
+            process, requests, reader = self._spawn()
+            self._processes.append(process)
+            self._requests.append(requests)
+            self._readers.append(reader)
+            self._outstanding.append(0)
+        self._collecting = True
+        self._collector = threading.Thread(target=self._collect, name="search-workers", daemon=True)
+        self._collector.start()
+        logger.info(f"Started {self.size} search worker processes ({self._context.get_start_method()})")
+
+    def _spawn(self) -> tuple:
+        """Start one worker from the current index and return (process, request queue, response reader)"""
+        requests = self._context.Queue()
+        # One response pipe per worker: a worker killed mid-write cannot hold a lock the others need
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_search_worker, args=(self._index, requests, writer), daemon=True)
+        process.start()
+        writer.close()
+        return process, requests, reader
+
+    def _replace_dead(self):
+        """Respawn workers that exited (killed, out of memory) so nothing is sent to a dead process"""
+        for worker, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            logger.error(f"Search worker {worker} exited with code {process.exitcode}, restarting it")
+            # Its queued updates are already in the index the replacement is forked from
+            stale = self._requests[worker]
+            stale.cancel_join_thread()
+            stale.close()
+            for request_id, (future, owner) in list(self._futures.items()):
+                if owner == worker:
+                    del self._futures[request_id]
+                    if not future.done():
+                        future.set_exception(RuntimeError(f"search worker {worker} died"))
+            self._outstanding[worker] = 0
+            # The collector closes the old response pipe once it reads EOF from it
+            self._processes[worker], self._requests[worker], self._readers[worker] = self._spawn()
+            self.restarts += 1
+
+    def _collect(self):
+        """Resolve futures from worker responses (runs in a thread)"""
+        while self._collecting:
+            readers = [reader for reader in self._readers if not reader.closed]
+            for reader in multiprocessing.connection.wait(readers, timeout=0.5):
+                try:
+                    request_id, hits, error = reader.recv()
+                except (EOFError, OSError):
+                    # The worker exited; _replace_dead starts its successor
+                    reader.close()
+                    continue
+                entry = self._futures.pop(request_id, None)
+                if entry is not None:
+                    self._loop.call_soon_threadsafe(self._resolve, entry, hits, error)
+
+    def _resolve(self, entry: tuple, hits: Optional[list], error: Optional[str]):
+        future, worker = entry
+        self._outstanding[worker] -= 1
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(hits)
+
+    def add(self, doc: Dict):
+        self._replace_dead()
+        for requests in self._requests:
+            requests.put(("add", doc))
+
+    def remove(self, file_id: str):
+        self._replace_dead()
+        for requests in self._requests:
+            requests.put(("remove", file_id))
+
+    async def search(self, query: str, limit: int, after: Optional[tuple]) -> List[Dict]:
+        """Rank in a worker and return the parent's documents with their scores"""
+        self._replace_dead()
+        worker = min(range(len(self._processes)), key=self._outstanding.__getitem__)
+        request_id = self._next_request
+        self._next_request += 1
+        future = self._loop.create_future()
+        self._futures[request_id] = (future, worker)
+        self._outstanding[worker] += 1
+        self._requests[worker].put(("search", request_id, query, limit, after))
+        self.queries += 1
+        
+        try:
+            hits = await asyncio.wait_for(future, self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self._futures.pop(request_id, None) is not None:
+                self._outstanding[worker] -= 1
+            self.fallbacks += 1
+            logger.error(f"Search worker {worker} failed ({e!r}), searching in-process")
+            return search_index.search(query, limit, after)
+        
+        files = []
+        for file_id, score in hits:
+            doc = search_index.get(file_id)
+            if doc is not None:
+                files.append({**doc, "score": score})
+        return files
+
+    def stop(self):
+        """Stop the workers and the response collector"""
+        if not self.running:
+            return
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._collecting = False
+        self._collector.join(timeout=5)
+        for reader in self._readers:
+            reader.close()
+        self._processes, self._requests, self._readers, self._outstanding = [], [], [], []
+        self._futures.clear()
+
+search_workers = SearchWorkerPool(size=SEARCH_WORKERS, timeout=SEARCH_WORKER_TIMEOUT)
+
+# Inline query result cache
+def fragment_matches(fragment: str, term: str) -> bool:
+    """Match a query word against an index term (prefix for very short words)"""
+    return term.startswith(fragment) if len(fragment) < 3 else fragment in term
+
+class QueryCache:
+    """LRU + TTL cache of search hits and rendered inline results.
+
+    Keys are (normalized query text, offset) pairs, so "Movie.Name",
+    "movie name" and " MOVIE  name " share one entry per page. Saving a batch of files drops every entry whose
+    query would match one of them, so new uploads show up immediately.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """Return (files, results) for a (normalized query, offset) key, or None"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def put(self, key: tuple, files: List[Dict], results: list):
+        self._entries[key] = (time.monotonic() + self.ttl, files, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_for(self, docs: List[Dict]):
+        """Drop cached queries that any of the given files would match, in one pass over the cache"""
+        if not docs or not self._entries:
+            return
+        term_docs: Dict[str, set] = {}
+        texts = []
+        for i, doc in enumerate(docs):
+            terms = set(doc["tokens"]) if "tokens" in doc else document_terms(doc)
+            for term in terms:
+                term_docs.setdefault(term, set()).add(i)
+            texts.append(" ".join(sorted(terms)))
+        # Newline-separated so one substring test rejects words no file of the batch contains
+        vocabulary = "\n" + "\n".join(term_docs)
+        text = "\n".join(texts)
+    
+        matching: Dict[str, set] = {}
+        for key in list(self._entries):
+            normalized = key[0]
+            candidates = None
+            for fragment in normalized.split():
+                docs_matched = matching.get(fragment)
+                if docs_matched is None:
+                    docs_matched = matching[fragment] = set()
+                    if (fragment if len(fragment) >= 3 else "\n" + fragment) in vocabulary:
+                        for term, indexes in term_docs.items():
+                            if fragment_matches(fragment, term):
+                                docs_matched |= indexes
+                # Every word has to match the same file
+                candidates = docs_matched if candidates is None else candidates & docs_matched
+                if not candidates:
+                    break
+            if candidates or normalized in text:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+query_cache = QueryCache(max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# Inline pagination cursors
+def encode_cursor(doc: Dict) -> str:
+    """Build an opaque inline offset from the last result of a page"""
+    raw = f"{doc.get('score', 0):.4f}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(offset: str) -> Optional[tuple]:
+    """Decode an inline offset into (score, _id), or None if it is invalid"""
+    try:
+        score, object_id = base64.urlsafe_b64decode(offset.encode()).decode().split("|")
+        return float(score), ObjectId(object_id)
+    except Exception:
+        return None
+
+# Search backends
+# Fields every MongoDB backend returns; the in-memory index carries them too
+SEARCH_PROJECTION = {"file_id": 1, "file_name": 1, "file_type": 1, "file_size": 1, "caption": 1, "added_at": 1}
+
+class SearchBackend:
+    """Interface of a file search backend.
+
+    search() returns up to `limit` file documents best first, each carrying a
+    float "score" (0 for unranked backends) so every backend paginates through
+    the same (score, _id) cursor. `after` is that decoded cursor or None.
+    """
+
+    name = ""
+
+    async def search(self, query: str, limit: int, after: Optional[tuple]) -> List[Dict]:
+        raise NotImplementedError
+
+    @staticmethod
+    async def _find(conditions: List[Dict], limit: int, after: Optional[tuple]) -> List[Dict]:
+        """Run an unranked query newest first"""
+        if after:
+            # Keyset pagination: continue below the last _id instead of skipping
+            conditions = conditions + [{"_id": {"$lt": after[1]}}]
+        mongo_query = {"$and": conditions} if conditions else {}
+        cursor = search_files_collection.find(mongo_query, SEARCH_PROJECTION).sort("_id", -1).limit(limit)
+        return [{**file_doc, "score": 0.0} async for file_doc in cursor]
+
+class RegexSearchBackend(SearchBackend):
+    """Case-insensitive regex over file_name and caption, newest first (unindexed)"""
+
+    name = "regex"
+
+    async def search(self, query: str, limit: int, after: Optional[tuple]) -> List[Dict]:
+        conditions = []
+        if query:
+            # Search with regex for better matching
+            regex_query = {"$regex": query, "$options": "i"}
+            conditions.append({
+                "$or": [
+                    {"file_name": regex_query},
+                    {"caption": regex_query}
+                ]
+            })
+        return await self._find(conditions, limit, after)
+
+class TextSearchBackend(SearchBackend):
+    """MongoDB $text search on the (file_name, caption) text index, ranked by textScore"""
+
+    name = "text"
+
+    async def search(self, query: str, limit: int, after: Optional[tuple]) -> List[Dict]:
+        if not query.strip():
+            return await self._find([], limit, after)
+        
+        # Rounded like encode_cursor so a page boundary compares exactly
+        pipeline = [
+            {"$match": {"$text": {"$search": query}}},
+            {"$project": {**SEARCH_PROJECTION, "score": {"$round": [{"$meta": "textScore"}, 4]}}},
+        ]
+        if after:
+            score, last_id = after
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": score}},
+                {"score": score, "_id": {"$lt": last_id}}
+            ]}})
+        pipeline += [{"$sort": {"score": -1, "_id": -1}}, {"$limit": limit}]
+        return [file_doc async for file_doc in search_files_collection.aggregate(pipeline)]
+
+class PrefixSearchBackend(SearchBackend):
+    """Anchored prefix match on the indexed normalized_name field, newest first"""
+
+    name = "prefix"
+
+    async def search(self, query: str, limit: int, after: Optional[tuple]) -> List[Dict]:
+        prefix = normalize_text(query)
+        conditions = []
+        if prefix:
+            # Case-sensitive and anchored, so MongoDB bounds the scan on the index
+            conditions.append({"normalized_name": {"$regex": f"^{re.escape(prefix)}"}})
+        return await self._find(conditions, limit, after)
+
+class MemorySearchBackend(SearchBackend):
+    """BM25-ranked in-memory SearchIndex; regex until the index has loaded"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.fallback = RegexSearchBackend()
+
+    async def search(self, query: str, limit: int, after: Optional[tuple]) -> List[Dict]:
+        if not search_index.loaded:
+            return await self.fallback.search(query, limit, after)
+        if search_workers.running:
+            return await search_workers.search(query, limit, after)
+        return search_index.search(query, limit, after)
+
+SEARCH_BACKENDS = {
+    backend.name: backend
+    for backend in (RegexSearchBackend, TextSearchBackend, PrefixSearchBackend, MemorySearchBackend)
+}
+
+def create_search_backend(name: str) -> SearchBackend:
+    """Instantiate the configured search backend, defaulting to regex"""
+    backend = SEARCH_BACKENDS.get(name)
+    if backend is None:
+        logger.error(f"Unknown SEARCH_BACKEND '{name}', using regex")
+        backend = RegexSearchBackend
+    return backend()
+
+search_backend = create_search_backend(SEARCH_BACKEND)
+
+# Featured files
+class FeaturedFiles:
+    """Recent and popular files that answer empty inline queries from memory.
+
+    Holds the FEATURED_RECENT newest files and the FEATURED_POPULAR files with
+    the highest download_count, interleaved without duplicates. New uploads
+    are pushed in by FileDocument.bulk_save; the popular half is re-read
+    after each batch of download counts is written.
+    """
+
+    def __init__(self, recent_size: int, popular_size: int):
+        self.recent_size = recent_size
+        self.popular_size = popular_size
+        self._recent: List[Dict] = []
+        self._popular: List[Dict] = []
+        self.files: List[Dict] = []
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def _rebuild(self):
+        """Interleave recent and popular files and number them for pagination"""
+        merged, seen = [], set()
+        for pair in zip_longest(self._recent, self._popular):
+            for file_doc in pair:
+                if file_doc is not None and file_doc["file_id"] not in seen:
+                    seen.add(file_doc["file_id"])
+                    merged.append(file_doc)
+        # Positions stand in for scores so the usual (score, _id) cursor pages through the list
+        self.files = [{**file_doc, "score": float(len(merged) - i)} for i, file_doc in enumerate(merged)]
+
+    async def load(self):
+        """Read the newest and most downloaded files"""
+        cursor = search_files_collection.find({}, SEARCH_PROJECTION).sort("_id", -1).limit(self.recent_size)
+        self._recent = [file_doc async for file_doc in cursor]
+        await self.refresh_popular()
+        self.loaded = True
+
+    async def refresh_popular(self):
+        """Re-read the most downloaded files"""
+        cursor = search_files_collection.find(
+            {"download_count": {"$gt": 0}}, {**SEARCH_PROJECTION, "download_count": 1}
+        ).sort("download_count", -1).limit(self.popular_size)
+        self._popular = [file_doc async for file_doc in cursor]
+        self._rebuild()
+
+    def add(self, file_doc: Dict):
+        """Put a newly indexed file at the top of the recent list"""
+        self._recent.insert(0, {key: file_doc[key] for key in ("_id", *SEARCH_PROJECTION) if key in file_doc})
+        del self._recent[self.recent_size:]
+        self._rebuild()
+
+    def remove(self, file_id: str):
+        self._recent = [file_doc for file_doc in self._recent if file_doc["file_id"] != file_id]
+        self._popular = [file_doc for file_doc in self._popular if file_doc["file_id"] != file_id]
+        self._rebuild()
+
+    def page(self, limit: int, after: Optional[tuple]) -> List[Dict]:
+        """Return the next `limit` featured files after a decoded cursor"""
+        start = 0 if after is None else max(0, len(self.files) - int(after[0]) + 1)
+        return self.files[start:start + limit]
+
+featured_files = FeaturedFiles(recent_size=FEATURED_RECENT, popular_size=FEATURED_POPULAR)
+
+class DownloadCounter:
+    """Count picked inline results per file and apply them with batched $inc updates"""
+
+    def __init__(self):
+        self._pending: Dict[ObjectId, int] = {}
+        self.counted = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def record(self, object_id: ObjectId):
+        self._pending[object_id] = self._pending.get(object_id, 0) + 1
+
+    async def flush(self):
+        """Write pending download counts and refresh the popular list"""
+        if not self._pending:
+            return
+        
+        pending, self._pending = self._pending, {}
+        operations = [
+            UpdateOne({"_id": object_id}, {"$inc": {"download_count": count}})
+            for object_id, count in pending.items()
+        ]
+        try:
+            await files_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error flushing download counts of {len(pending)} files: {e}")
+            for object_id, count in pending.items():
+                self._pending[object_id] = self._pending.get(object_id, 0) + count
+            return
+        
+        self.counted += sum(pending.values())
+        if featured_files.loaded:
+            await featured_files.refresh_popular()
+
+download_counter = DownloadCounter()
+
 # Database models
 class FileDocument:
     def __init__(self, file_id: str, file_name: str, file_type: str, 
-                 file_size: int, caption: str = "", group_id: int = None):
+                 file_size: int, caption: str = "", group_id: int = None,
+                 file_unique_id: str = None, message_id: int = None):
         self.file_id = file_id
         self.file_name = file_name
         self.file_type = file_type
         self.file_size = file_size
         self.caption = caption
         self.group_id = group_id
+        self.file_unique_id = file_unique_id
         self.added_at = datetime.now()
         self.download_count = 0
+        self.sources = [{"chat_id": group_id, "message_id": message_id, "file_id": file_id}]
+
+    @property
+    def content_key(self) -> str:
+        """Fallback identity of the file content: size plus normalized name"""
+        return f"{self.file_size}:{parse_file_name(self.file_name)['normalized_name']}"
+
+    def merge_sources(self, other: "FileDocument"):
+        """Record another post of the same file as a source of this one"""
+        for source in other.sources:
+            if source not in self.sources:
+                self.sources.append(source)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the stored representation of the file"""
+        return {
+            "file_id": self.file_id,
+            "file_unique_id": self.file_unique_id,
+            "file_name": self.file_name,
+            "file_type": self.file_type,
+            "file_size": self.file_size,
+            "caption": self.caption,
+            "group_id": self.group_id,
+            "added_at": self.added_at,
+            "download_count": self.download_count,
+            "content_key": self.content_key,
+            "sources": self.sources,
+            **search_keys(self.file_name, self.caption)
+        }
+
+    def upsert_operation(self) -> UpdateOne:
+        """Insert the file as a new canonical document, or add it as a source of the existing one.
+
+        An existing document matches on Telegram's file_unique_id (a forward of
+        the same file), on content_key (a re-upload) or on file_id.
+        """
+        doc = self.to_dict()
+        sources = doc.pop("sources")
+        duplicates = [{"content_key": self.content_key}, {"file_id": self.file_id}]
+        if self.file_unique_id:
+            duplicates.insert(0, {"file_unique_id": self.file_unique_id})
+        return UpdateOne(
+            {"$or": duplicates},
+            {"$setOnInsert": doc, "$addToSet": {"sources": {"$each": sources}}},
+            upsert=True
+        )
 
     async def save(self):
         """Save file to database"""
         try:
-            await files_collection.update_one(
-                {"file_id": self.file_id},
-                {
-                    "$set": {
-                        "file_id": self.file_id,
-                        "file_name": self.file_name,
-                        "file_type": self.file_type,
-                        "file_size": self.file_size,
-                        "caption": self.caption,
-                        "group_id": self.group_id,
-                        "added_at": self.added_at,
-                        "download_count": self.download_count
-                    }
-                },
-                upsert=True
-            )
-            return True
+            return await FileDocument.bulk_save([self]) == 1
         except Exception as e:
             logger.error(f"Error saving file {self.file_id}: {e}")
             return False
 
     @staticmethod
-    async def search_files(query: str, limit: int = 10) -> List[Dict]:
-        """Search files by name or caption"""
+    async def bulk_save(file_docs: List["FileDocument"]) -> int:
+        """Upsert many files with one unordered bulk_write, returning the number written.
+
+        Reposts of a file that is already stored only extend its sources.
+        """
+        operations = [file_doc.upsert_operation() for file_doc in file_docs]
+        if not operations:
+            return 0
+        
         try:
-            # Create text index if it doesn't exist
-            await files_collection.create_index([("file_name", "text"), ("caption", "text")])
-            
-            # Search with regex for better matching
-            regex_query = {"$regex": query, "$options": "i"}
-            cursor = files_collection.find({
-                "$or": [
-                    {"file_name": regex_query},
-                    {"caption": regex_query}
-                ]
-            }).limit(limit)
-            
-            files = []
-            async for file_doc in cursor:
-                files.append(file_doc)
-            
-            return files
+            result = await files_collection.bulk_write(operations, ordered=False)
+            upserted_ids = result.upserted_ids
+            failed = set()
+        except BulkWriteError as e:
+            # Unordered writes keep going past errors; keep the ones that succeeded
+            upserted_ids = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logger.error(f"Bulk save failed for {len(failed)} of {len(operations)} files")
+        
+        # Keep the in-memory index, cached answers and counters in step with new documents
+        saved = []
+        for i, object_id in upserted_ids.items():
+            doc = file_docs[i].to_dict()
+            doc["_id"] = object_id
+            if search_index.loaded:
+                search_index.add(doc)
+                search_workers.add(doc)
+            if featured_files.loaded:
+                featured_files.add(doc)
+            saved.append(doc)
+        query_cache.invalidate_for(saved)
+        try:
+            await stats.files_added(saved)
         except Exception as e:
-            logger.error(f"Error searching files: {e}")
+            logger.error(f"Error updating stored file type stats: {e}")
+        
+        return len(operations) - len(failed)
+
+    @staticmethod
+    async def search_files(query: str, limit: int = 10, offset: str = "") -> List[Dict]:
+        """Search files by name or caption with the configured backend.
+
+        `offset` is the opaque cursor from a previous page (see encode_cursor).
+        """
+        after = None
+        if offset:
+            after = decode_cursor(offset)
+            if after is None:
+                return []
+        
+        if not query.strip() and featured_files.loaded:
+            # The "Search Files" button opens an empty query: answer it without touching the database
+            return featured_files.page(limit, after)
+        
+        try:
+            return await search_backend.search(query, limit, after)
+        except Exception as e:
+            logger.error(f"Error searching files ({search_backend.name}): {e}")
             return []
 
+# Update context
+# Handler groups: Pyrogram runs at most one matching handler per group, lowest group first
+GROUP_CONTEXT = -1   # attach UpdateContext and drop updates of banned users before any I/O
+GROUP_HANDLERS = 0   # commands, file indexing, inline mode, callbacks and chat events
+GROUP_TRACKING = 1   # user registration, runs after the handler for every message
+
+class UpdateContext:
+    """Memoized user checks for one update, shared by every handler it reaches.
+
+    The GROUP_CONTEXT pre-handlers attach one to each update; handlers fetch
+    it with update_context() so ban, subscription and registration are each
+    resolved at most once per update.
+    """
+
+    def __init__(self, user: Optional[User]):
+        self.user = user
+        self.user_id = user.id if user else None
+        self._banned: Optional[bool] = None
+        self._subscribed: Optional[bool] = None
+        self.registered = False
+
+    async def is_banned(self) -> bool:
+        if self._banned is None:
+            self._banned = bool(self.user_id) and await is_banned(self.user_id)
+        return self._banned
+
+    async def is_subscribed(self, refresh: bool = False) -> bool:
+        if self._subscribed is None or refresh:
+            self._subscribed = bool(self.user_id) and await check_user_subscription(self.user_id, refresh)
+        return self._subscribed
+
+    async def register(self):
+        """Record the user's activity once per update; banned users are never registered"""
+        if self.user and not self.registered and not await self.is_banned():
+            self.registered = True
+            await add_user(self.user_id, self.user.username, self.user.first_name)
+
+def update_context(update) -> UpdateContext:
+    """Return the context attached to an update, attaching one if no pre-handler did"""
+    context = getattr(update, "context", None)
+    if context is None:
+        context = UpdateContext(update.from_user)
+        update.context = context
+    return context
+
+@app.on_message(group=GROUP_CONTEXT)
+async def message_context(client: Client, message: Message):
+    """Attach the update context; banned users only reach command handlers"""
+    context = update_context(message)
+    if await context.is_banned() and not (message.text or "").startswith("/"):
+        raise StopPropagation
+
+@app.on_callback_query(group=GROUP_CONTEXT)
+async def callback_context(client: Client, callback_query: CallbackQuery):
+    """Attach the update context and turn banned users away"""
+    if await update_context(callback_query).is_banned():
+        await callback_query.answer("❌ You are banned from using this bot.", show_alert=True)
+        raise StopPropagation
+
+@app.on_inline_query(group=GROUP_CONTEXT)
+async def inline_context(client: Client, query: InlineQuery):
+    """Attach the update context and ignore banned users"""
+    if await update_context(query).is_banned():
+        raise StopPropagation
+
 # Command handlers
-@app.on_message(filters.command("start"))
+@app.on_message(filters.command("start"), group=GROUP_HANDLERS)
+@instrument_handler
 async def start_command(client: Client, message: Message):
     """Handle /start command"""
-    user_id = message.from_user.id
-    username = message.from_user.username
     first_name = message.from_user.first_name
+    context = update_context(message)
     
     # Check if user is banned
-    if await is_banned(user_id):
+    if await context.is_banned():
         await message.reply("❌ You are banned from using this bot.")
         return
     
     # Check if user is subscribed to required channel
-    if not await check_user_subscription(user_id):
+    if not await context.is_subscribed():
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("📢 Join Channel", url=f"https://t.me/{REQUIRED_CHANNEL.replace('@', '').replace('-100', '')}")],
             [InlineKeyboardButton("🔄 Check Subscription", callback_data="check_sub")]
@@ -251,7 +2852,7 @@ async def start_command(client: Client, message: Message):
         return
     
     # Add user to database
-    await add_user(user_id, username, first_name)
+    await context.register()
     
     # Welcome message with buttons
     keyboard = InlineKeyboardMarkup([
@@ -283,7 +2884,8 @@ Enjoy searching! 🔍
     
     await message.reply(welcome_text, reply_markup=keyboard)
 
-@app.on_message(filters.command("help"))
+@app.on_message(filters.command("help"), group=GROUP_HANDLERS)
+@instrument_handler
 async def help_command(client: Client, message: Message):
     """Handle /help command"""
     help_text = """
@@ -317,7 +2919,8 @@ If you need help, contact the admin or join our support group.
     
     await message.reply(help_text)
 
-@app.on_message(filters.command("about"))
+@app.on_message(filters.command("about"), group=GROUP_HANDLERS)
+@instrument_handler
 async def about_command(client: Client, message: Message):
     """Handle /about command"""
     uptime = await get_uptime()
@@ -358,7 +2961,8 @@ async def about_command(client: Client, message: Message):
     
     await message.reply(about_text)
 
-@app.on_message(filters.command("id"))
+@app.on_message(filters.command("id"), group=GROUP_HANDLERS)
+@instrument_handler
 async def id_command(client: Client, message: Message):
     """Handle /id command"""
     if message.reply_to_message:
@@ -393,7 +2997,8 @@ async def id_command(client: Client, message: Message):
     await message.reply(id_text)
 
 # Admin commands
-@app.on_message(filters.command("ban") & filters.user(OWNER_ID))
+@app.on_message(filters.command("ban") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
 async def ban_command(client: Client, message: Message):
     """Handle /ban command (Owner only)"""
     if not message.reply_to_message:
@@ -416,17 +3021,21 @@ async def ban_command(client: Client, message: Message):
             "banned_at": datetime.now(),
             "banned_by": message.from_user.id
         })
+        banned_users.add(user_id)
+        stats.banned += 1
         
         await message.reply(f"✅ User {user_to_ban.first_name} (ID: {user_id}) has been banned.")
         logger.info(f"User {user_id} banned by {message.from_user.id}")
         
     except DuplicateKeyError:
+        banned_users.add(user_id)
         await message.reply("❌ User is already banned.")
     except Exception as e:
         await message.reply(f"❌ Error banning user: {e}")
         logger.error(f"Error banning user {user_id}: {e}")
 
-@app.on_message(filters.command("unban") & filters.user(OWNER_ID))
+@app.on_message(filters.command("unban") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
 async def unban_command(client: Client, message: Message):
     """Handle /unban command (Owner only)"""
     if not message.reply_to_message:
@@ -440,6 +3049,8 @@ async def unban_command(client: Client, message: Message):
         result = await banned_collection.delete_one({"user_id": user_id})
         
         if result.deleted_count > 0:
+            banned_users.discard(user_id)
+            stats.banned = max(stats.banned - 1, 0)
             await message.reply(f"✅ User {user_to_unban.first_name} (ID: {user_id}) has been unbanned.")
             logger.info(f"User {user_id} unbanned by {message.from_user.id}")
         else:
@@ -449,60 +3060,47 @@ async def unban_command(client: Client, message: Message):
         await message.reply(f"❌ Error unbanning user: {e}")
         logger.error(f"Error unbanning user {user_id}: {e}")
 
-@app.on_message(filters.command("broadcast") & filters.user(OWNER_ID))
+@app.on_message(filters.command("broadcast") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
 async def broadcast_command(client: Client, message: Message):
     """Handle /broadcast command (Owner only)"""
-    if not message.reply_to_message:
-        await message.reply("❌ Please reply to a message to broadcast it.")
+    action = message.command[1].lower() if len(message.command) > 1 else ""
+    
+    if action == "status":
+        await message.reply(broadcast_engine.progress_text())
         return
     
-    broadcast_message = message.reply_to_message
-    users_cursor = users_collection.find({})
-    total_users = await get_user_count()
+    if action == "cancel":
+        if broadcast_engine.cancel():
+            await message.reply("🛑 Broadcast cancelled.")
+        else:
+            await message.reply("❌ No broadcast is running.")
+        return
     
-    if total_users == 0:
-        await message.reply("❌ No users found to broadcast to.")
+    if broadcast_engine.running:
+        await message.reply("❌ A broadcast is already running.\nUse /broadcast status or /broadcast cancel")
         return
     
-    await message.reply(f"📢 Starting broadcast to {total_users} users...")
+    if action == "resume":
+        progress_message = await message.reply("📢 Resuming broadcast...")
+        if not await broadcast_engine.resume(client, progress_message):
+            await progress_message.edit_text("❌ No interrupted broadcast to resume.")
+        return
     
-    success_count = 0
-    failed_count = 0
+    if not message.reply_to_message:
+        await message.reply("❌ Please reply to a message to broadcast it.\n"
+                            "Other actions: /broadcast status | cancel | resume")
+        return
     
-    async for user_doc in users_cursor:
-        try:
-            user_id = user_doc["user_id"]
-            
-            # Skip if user is banned
-            if await is_banned(user_id):
-                continue
-            
-            # Forward the message
-            await broadcast_message.forward(user_id)
-            success_count += 1
-            
-            # Small delay to avoid rate limiting
-            await asyncio.sleep(0.1)
-            
-        except FloodWait as e:
-            await asyncio.sleep(e.value)
-            try:
-                await broadcast_message.forward(user_doc["user_id"])
-                success_count += 1
-            except:
-                failed_count += 1
-        except Exception as e:
-            failed_count += 1
-            logger.error(f"Error broadcasting to user {user_doc['user_id']}: {e}")
-    
-    await message.reply(
-        f"📢 Broadcast completed!\n"
-        f"✅ Success: {success_count}\n"
-        f"❌ Failed: {failed_count}\n"
-        f"📊 Total: {total_users}"
-    )
+    if await get_user_count() == 0:
+        await message.reply("❌ No users found to broadcast to.")
+        return
+    
+    progress_message = await message.reply("📢 Starting broadcast...")
+    await broadcast_engine.start(client, message.reply_to_message, progress_message)
 
-@app.on_message(filters.command("status") & filters.user(OWNER_ID))
+@app.on_message(filters.command("status") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
 async def status_command(client: Client, message: Message):
     """Handle /status command (Owner only)"""
     uptime = await get_uptime()
@@ -510,6 +3108,14 @@ async def status_command(client: Client, message: Message):
     file_count = await get_file_count()
     banned_count = await get_banned_count()
     
+    lookups = query_cache.hits + query_cache.misses
+    hit_rate = query_cache.hits * 100 / lookups if lookups else 0.0
+    
+    file_types = "\n".join(
+        f"• <b>{file_type.title()}:</b> {entry['count']:,} ({format_size(entry['bytes'])})"
+        for file_type, entry in sorted(stats.file_types.items(), key=lambda item: -item[1]["count"])
+    ) or "• No files yet"
+    
     # Get system info
     import psutil
     cpu_percent = psutil.cpu_percent()
@@ -524,6 +3130,9 @@ async def status_command(client: Client, message: Message):
 <b>📁 Total Files:</b> {file_count:,}
 <b>🚫 Banned Users:</b> {banned_count:,}
 
+<b>🗂️ Files by Type:</b> ({format_size(stats.total_bytes)} total)
+{file_types}
+
 <b>💻 System Resources:</b>
 • <b>CPU Usage:</b> {cpu_percent}%
 • <b>Memory Usage:</b> {memory.percent}% ({memory.used // (1024**3)}GB / {memory.total // (1024**3)}GB)
@@ -539,14 +3148,37 @@ async def status_command(client: Client, message: Message):
 • <b>Branding:</b> {BRANDING_TAG[:30]}...
 
 <b>📈 Performance:</b>
-• <b>Response Time:</b> < 1s
-• <b>Database:</b> Optimized
-• <b>Memory:</b> Efficient
+• <b>Handlers:</b> {metrics.summary("handler", "handler_errors")}
+• <b>Database:</b> {metrics.summary("mongo", "mongo_errors")}
+• <b>Telegram API:</b> {metrics.summary("telegram", "telegram_errors")}
+• <b>FloodWait:</b> {metrics.counter_total("floodwait"):,.0f}s
+• <b>DB Pool:</b> {mongo_pool_metrics.in_use}/{MONGO_MAX_POOL_SIZE} in use, waits: {metrics.summary("mongo_pool", "mongo_pool_failures")}
+
+<b>🔍 Search Cache:</b>
+• <b>Backend:</b> {search_backend.name}
+• <b>Search Workers:</b> {search_workers.workers} processes, {search_workers.queries:,} queries ({search_workers.fallbacks:,} in-process fallbacks, {search_workers.restarts:,} restarts)
+• <b>Entries:</b> {len(query_cache):,} / {query_cache.max_entries:,}
+• <b>Hits / Misses:</b> {query_cache.hits:,} / {query_cache.misses:,} ({hit_rate:.1f}% hit rate)
+• <b>Invalidations:</b> {query_cache.invalidations:,}
+• <b>Featured:</b> {len(featured_files):,} files ({download_counter.counted:,} downloads counted)
+• <b>Superseded Queries:</b> {inline_debouncer.coalesced:,} coalesced, {inline_debouncer.cancelled:,} cancelled
+• <b>Rendered Results:</b> {len(render_cache):,} / {render_cache.max_entries:,} ({render_cache.hits:,} reused)
+
+<b>📥 Ingest Queue:</b>
+• <b>Queued:</b> {ingest_pipeline.depth:,} / {ingest_pipeline.max_size:,} ({ingest_pipeline.backpressure_waits:,} full-queue waits)
+• <b>Indexed:</b> {ingest_pipeline.indexed:,} ({ingest_pipeline.duplicates:,} duplicates merged, {ingest_pipeline.rejected:,} rejected)
+• <b>Failed:</b> {ingest_pipeline.failed:,} • <b>Last Flush:</b> {ingest_pipeline.last_flush_latency * 1000:.0f}ms
+
+<b>📝 User Activity Buffer:</b>
+• <b>Pending Users:</b> {user_activity.depth:,}
+• <b>Flushed:</b> {user_activity.flushed_users:,} users in {user_activity.flushes:,} batches ({user_activity.failed_flushes} failed)
+• <b>Flush Latency:</b> {user_activity.last_flush_latency * 1000:.0f}ms (max {user_activity.max_flush_latency * 1000:.0f}ms)
     """
     
     await message.reply(status_text)
 
-@app.on_message(filters.command("send") & filters.user(OWNER_ID))
+@app.on_message(filters.command("send") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
 async def send_file_command(client: Client, message: Message):
     """Handle /send command to send files to users (Owner only)"""
     if not message.reply_to_message:
@@ -578,77 +3210,441 @@ async def send_file_command(client: Client, message: Message):
         logger.error(f"Error sending file to user {target_user_id}: {e}")
 
 # File indexing and management
-@app.on_message(filters.document | filters.video | filters.audio | filters.photo)
-async def index_file(client: Client, message: Message):
-    """Index files automatically from source channels or admin uploads"""
-    # Check if message is from source channel or user is admin
-    is_from_source = message.chat.id in SOURCE_CHANNEL_IDS
-    is_admin_upload = await is_admin(message.from_user.id, message.chat.id)
+def extract_file_document(message: Message) -> Optional["FileDocument"]:
+    """Build a FileDocument from a media message, or None if it carries no file"""
+    if message.document:
+        media = message.document
+        file_name = message.document.file_name or "Unknown Document"
+        file_type = "document"
+    elif message.video:
+        media = message.video
+        file_name = message.video.file_name or "Unknown Video"
+        file_type = "video"
+    elif message.audio:
+        media = message.audio
+        file_name = message.audio.file_name or "Unknown Audio"
+        file_type = "audio"
+    elif message.photo:
+        media = message.photo
+        file_name = "Photo"
+        file_type = "photo"
+    else:
+        return None
     
-    if not (is_from_source or is_admin_upload):
-        return
+    # Add branding to caption
+    caption = message.caption or ""
+    if BRANDING_TAG and BRANDING_TAG not in caption:
+        caption = f"{caption}\n\n{BRANDING_TAG}" if caption else BRANDING_TAG
     
+    return FileDocument(
+        file_id=media.file_id,
+        file_name=file_name,
+        file_type=file_type,
+        file_size=media.file_size or 0,
+        caption=caption,
+        group_id=message.chat.id,
+        file_unique_id=media.file_unique_id,
+        message_id=message.id
+    )
+
+@app.on_message(filters.document | filters.video | filters.audio | filters.photo, group=GROUP_HANDLERS)
+@instrument_handler
+async def index_file(client: Client, message: Message):
+    """Index files automatically from source channels or admin uploads"""
     try:
-        # Get file information
-        if message.document:
-            file_id = message.document.file_id
-            file_name = message.document.file_name or "Unknown Document"
-            file_type = "document"
-            file_size = message.document.file_size or 0
-        elif message.video:
-            file_id = message.video.file_id
-            file_name = message.video.file_name or "Unknown Video"
-            file_type = "video"
-            file_size = message.video.file_size or 0
-        elif message.audio:
-            file_id = message.audio.file_id
-            file_name = message.audio.file_name or "Unknown Audio"
-            file_type = "audio"
-            file_size = message.audio.file_size or 0
-        elif message.photo:
-            file_id = message.photo.file_id
-            file_name = "Photo"
-            file_type = "photo"
-            file_size = message.photo.file_size or 0
-        else:
+        file_doc = extract_file_document(message)
+        if file_doc is None:
             return
         
-        # Add branding to caption
-        caption = message.caption or ""
-        if BRANDING_TAG and BRANDING_TAG not in caption:
-            caption = f"{caption}\n\n{BRANDING_TAG}" if caption else BRANDING_TAG
-        
-        # Create file document
-        file_doc = FileDocument(
-            file_id=file_id,
-            file_name=file_name,
-            file_type=file_type,
-            file_size=file_size,
-            caption=caption,
-            group_id=message.chat.id
-        )
+        # Source channels and anonymous group admins need no check; other uploads
+        # are checked by the ingest consumer
+        is_from_source = message.chat.id in SOURCE_CHANNEL_IDS
+        is_anonymous_admin = message.sender_chat is not None and message.sender_chat.id == message.chat.id
+        user_id = message.from_user.id if message.from_user else None
+        if not (is_from_source or is_anonymous_admin or user_id):
+            # Posts of other channels have no sender to check
+            return
         
-        # Save to database
-        if await file_doc.save():
-            logger.info(f"Indexed file: {file_name} from {'source channel' if is_from_source else 'admin upload'}")
-        else:
-            logger.error(f"Failed to index file: {file_name}")
+        await ingest_pipeline.put(file_doc, is_from_source or is_anonymous_admin, user_id, message.chat.id)
             
     except Exception as e:
         logger.error(f"Error indexing file: {e}")
 
+@app.on_message(filters.command("migrate") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
+async def migrate_command(client: Client, message: Message):
+    """Handle /migrate command to backfill search keys on old files (Owner only)"""
+    progress_message = await message.reply("🔄 Adding search keys to existing files...")
+    try:
+        migrated = await migrate_search_keys()
+        await progress_message.edit_text(f"✅ Search keys added to {migrated:,} files.")
+    except Exception as e:
+        await progress_message.edit_text(f"❌ Migration stopped: {e}\nRun /migrate again to continue.")
+        logger.error(f"Error migrating search keys: {e}")
+
+@app.on_message(filters.command("dedupe") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
+async def dedupe_command(client: Client, message: Message):
+    """Handle /dedupe command to collapse duplicate files (Owner only)"""
+    progress_message = await message.reply("🔄 Looking for duplicate files...")
+    try:
+        groups, deleted = await dedupe_files()
+        await progress_message.edit_text(f"✅ Collapsed {groups:,} duplicate groups, removed {deleted:,} files.")
+        logger.info(f"Dedupe removed {deleted} files in {groups} groups")
+    except Exception as e:
+        await progress_message.edit_text(f"❌ Dedupe stopped: {e}\nRun /dedupe again to continue.")
+        logger.error(f"Error deduplicating files: {e}")
+
+# Channel history backfill
+class ChannelBackfill:
+    """Walk a channel's history and bulk-index every file in it.
+
+    Bots can't call messages.getHistory, so the history is read by message
+    id in pages of BACKFILL_PAGE_SIZE ids through get_messages. Files are
+    upserted with FileDocument.bulk_save every BACKFILL_BATCH_SIZE files and
+    the last processed message id is checkpointed per channel in
+    backfill_collection, so a restarted backfill continues where it stopped.
+    """
+
+    def __init__(self, page_size: int, batch_size: int, progress_interval: int):
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.state: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._run_started = 0.0
+        self._run_start_id = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, client: Client, channel_id: int, target_message_id: Optional[int],
+                    progress_message: Message) -> bool:
+        """Start or resume the backfill of a channel; False if there is nothing to do"""
+        checkpoint = await backfill_collection.find_one({"_id": channel_id}) or {
+            "_id": channel_id,
+            "last_message_id": 0,
+            "target_message_id": 0,
+            "indexed": 0
+        }
+        if target_message_id:
+            checkpoint["target_message_id"] = max(target_message_id, checkpoint["target_message_id"])
+        if checkpoint["last_message_id"] >= checkpoint["target_message_id"]:
+            return False
+        
+        checkpoint["status"] = "running"
+        self.state = checkpoint
+        self._run_started = time.monotonic()
+        self._run_start_id = checkpoint["last_message_id"]
+        self._task = asyncio.create_task(self._run(client, checkpoint, progress_message))
+        return True
+
+    def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self._task.cancel()
+        return True
+
+    async def stop(self):
+        """Stop the running backfill on shutdown; it resumes from its checkpoint"""
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def progress_text(self) -> str:
+        state = self.state
+        if state is None:
+            return "📥 No backfill has been run since startup."
+        
+        done = state["last_message_id"]
+        target = max(state["target_message_id"], 1)
+        elapsed = max(time.monotonic() - self._run_started, 1e-6)
+        rate = (done - self._run_start_id) / elapsed
+        eta = f"{int((target - done) / rate)}s" if rate > 0 and state["status"] == "running" else "-"
+        
+        return (
+            f"📥 <b>Backfill {state['status']}</b> • <code>{state['_id']}</code>\n"
+            f"📊 Messages: {done:,}/{target:,} ({done * 100 // target}%)\n"
+            f"📁 Files indexed: {state['indexed']:,}\n"
+            f"⚡ Rate: {rate:.0f} msg/s • ETA: {eta}"
+        )
+
+    async def _checkpoint(self, state: Dict):
+        state["updated_at"] = datetime.now()
+        await backfill_collection.update_one(
+            {"_id": state["_id"]},
+            {"$set": {key: value for key, value in state.items() if key != "_id"}},
+            upsert=True
+        )
+
+    async def _report(self, progress_message: Message):
+        try:
+            await progress_message.edit_text(self.progress_text())
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.error(f"Error updating backfill progress: {e}")
+
+    async def _fetch_page(self, client: Client, channel_id: int, message_ids: List[int]) -> list:
+        while True:
+            try:
+                return await client.get_messages(channel_id, message_ids)
+            except FloodWait as e:
+                logger.warning(f"Backfill FloodWait: sleeping {e.value}s")
+                await asyncio.sleep(e.value)
+
+    async def _flush(self, state: Dict, batch: List["FileDocument"], last_message_id: int):
+        if batch:
+            await FileDocument.bulk_save(batch)
+            state["indexed"] += len(batch)
+        state["last_message_id"] = last_message_id
+        await self._checkpoint(state)
+
+    async def _run(self, client: Client, state: Dict, progress_message: Message):
+        channel_id = state["_id"]
+        batch: List[FileDocument] = []
+        next_id = state["last_message_id"] + 1
+        last_report = 0.0
+        try:
+            while next_id <= state["target_message_id"]:
+                page_end = min(next_id + self.page_size, state["target_message_id"] + 1)
+                messages = await self._fetch_page(client, channel_id, list(range(next_id, page_end)))
+                for message in messages:
+                    if message is None or message.empty:
+                        continue
+                    file_doc = extract_file_document(message)
+                    if file_doc is not None:
+                        batch.append(file_doc)
+                next_id = page_end
+                
+                if len(batch) >= self.batch_size:
+                    await self._flush(state, batch, next_id - 1)
+                    batch = []
+                else:
+                    state["last_message_id"] = next_id - 1
+                
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    await self._report(progress_message)
+            
+            await self._flush(state, batch, next_id - 1)
+            state["status"] = "completed"
+        except asyncio.CancelledError:
+            state["status"] = "stopped"
+        except Exception as e:
+            state["status"] = "failed"
+            logger.error(f"Backfill of {channel_id} stopped by error: {e}")
+        
+        if state["status"] != "completed":
+            # Unflushed files are fetched again on resume, so rewind to the saved checkpoint
+            saved = await backfill_collection.find_one({"_id": channel_id})
+            state["last_message_id"] = saved["last_message_id"] if saved else 0
+            state["indexed"] = saved["indexed"] if saved else 0
+        try:
+            await self._checkpoint(state)
+        except Exception as e:
+            logger.error(f"Error saving backfill checkpoint of {channel_id}: {e}")
+        await self._report(progress_message)
+        logger.info(f"Backfill of {channel_id} {state['status']} at message {state['last_message_id']}, "
+                    f"{state['indexed']} files indexed")
+
+channel_backfill = ChannelBackfill(
+    page_size=BACKFILL_PAGE_SIZE,
+    batch_size=BACKFILL_BATCH_SIZE,
+    progress_interval=BACKFILL_PROGRESS_INTERVAL
+)
+
+@app.on_message(filters.command("backfill") & filters.user(OWNER_ID), group=GROUP_HANDLERS)
+@instrument_handler
+async def backfill_command(client: Client, message: Message):
+    """Handle /backfill command to index a channel's history (Owner only)"""
+    args = message.command[1:]
+    action = args[0].lower() if args else ""
+    
+    if action == "status":
+        await message.reply(channel_backfill.progress_text())
+        return
+    
+    if action == "cancel":
+        if channel_backfill.cancel():
+            await message.reply("🛑 Backfill stopped. Run /backfill <channel_id> to resume.")
+        else:
+            await message.reply("❌ No backfill is running.")
+        return
+    
+    if channel_backfill.running:
+        await message.reply("❌ A backfill is already running.\nUse /backfill status or /backfill cancel")
+        return
+    
+    try:
+        channel_id = int(args[0])
+        target_message_id = int(args[1]) if len(args) > 1 else None
+    except (IndexError, ValueError):
+        await message.reply(
+            "❌ Usage: /backfill <channel_id> [last_message_id]\n"
+            "Omit last_message_id to resume from the saved checkpoint.\n"
+            "Other actions: /backfill status | cancel"
+        )
+        return
+    
+    if target_message_id is None and not await backfill_collection.count_documents({"_id": channel_id}, limit=1):
+        # Bots can't read a channel's latest message id, so the first run needs it
+        await message.reply(
+            f"❌ <code>{channel_id}</code> has no saved checkpoint yet.\n"
+            "Usage: /backfill <channel_id> <last_message_id>\n"
+            "Pass the id of the channel's newest message for the first run."
+        )
+        return
+    
+    progress_message = await message.reply(f"📥 Starting backfill of <code>{channel_id}</code>...")
+    if not await channel_backfill.start(client, channel_id, target_message_id, progress_message):
+        await progress_message.edit_text("✅ Nothing to backfill: the checkpoint is already at the last message.\n"
+                                         "Pass a newer last_message_id to continue.")
+
+# Inline result rendering
+# Icon, type label and thumbnail per file type; other types use the generic row
+FILE_TYPE_STYLES = {
+    "video": ("🎬", "Video", "https://img.icons8.com/color/48/000000/video.png"),
+    "audio": ("🎵", "Audio", "https://img.icons8.com/color/48/000000/audio.png"),
+    "document": ("📄", "Document", "https://img.icons8.com/color/48/000000/document.png"),
+}
+
+def render_file_result(file_doc: Dict) -> InlineQueryResultArticle:
+    """Render one file document as an inline result"""
+    icon, label, thumb_url = FILE_TYPE_STYLES.get(file_doc["file_type"], ("📁", None, None))
+    size = f"{file_doc['file_size'] // (1024*1024)}MB"
+    result_id = str(file_doc["_id"]) if "_id" in file_doc else hashlib.md5(file_doc["file_id"].encode()).hexdigest()
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=f"{icon} {file_doc['file_name']}",
+        description=f"{label or 'File'} • {size}",
+        input_message_content=InputTextMessageContent(
+            f"{icon} <b>{file_doc['file_name']}</b>\n\n"
+            f"📁 Type: {label or file_doc['file_type'].title()}\n"
+            f"📊 Size: {size}\n"
+            f"📅 Added: {file_doc['added_at'].strftime('%Y-%m-%d')}"
+        ),
+        thumb_url=thumb_url
+    )
+
+class RenderCache:
+    """LRU cache of rendered inline results keyed by file_id.
+
+    Each entry remembers the fields it was rendered from and is re-rendered
+    when they differ, so an edited document never serves a stale result.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _fingerprint(file_doc: Dict) -> tuple:
+        return (file_doc.get("_id"), file_doc["file_name"], file_doc["file_type"],
+                file_doc["file_size"], file_doc["added_at"])
+
+    def get(self, file_doc: Dict) -> InlineQueryResultArticle:
+        """Return the rendered result for a document, rendering it on a miss"""
+        file_id = file_doc["file_id"]
+        fingerprint = self._fingerprint(file_doc)
+        entry = self._entries.get(file_id)
+        if entry is not None and entry[0] == fingerprint:
+            self._entries.move_to_end(file_id)
+            self.hits += 1
+            return entry[1]
+        
+        self.misses += 1
+        result = render_file_result(file_doc)
+        self._entries[file_id] = (fingerprint, result)
+        self._entries.move_to_end(file_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+    def discard(self, file_id: str):
+        self._entries.pop(file_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+render_cache = RenderCache(max_entries=RENDER_CACHE_SIZE)
+
+def build_file_results(files: List[Dict]) -> list:
+    """Render inline results for a list of file documents"""
+    return [render_cache.get(file_doc) for file_doc in files]
+
+# Inline keystroke debouncing
+class InlineDebouncer:
+    """Answer only the newest inline query of each user.
+
+    Telegram sends a query for almost every keystroke. Each query is answered
+    from a per-user task that first waits INLINE_DEBOUNCE seconds; a newer
+    query cancels that task, so a burst of typing costs one search and an
+    in-flight answer is abandoned. Pagination requests skip the wait. The
+    handler only schedules the task, so no dispatcher worker sits in the wait.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._answering: set = set()
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def submit(self, client: Client, query: InlineQuery, answer):
+        """Schedule answer(client, query), superseding the user's pending or running answer"""
+        user_id = query.from_user.id
+        previous = self._tasks.pop(user_id, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            if previous in self._answering:
+                self.cancelled += 1
+            else:
+                self.coalesced += 1
+        
+        task = self._tasks[user_id] = asyncio.create_task(self._answer(client, query, answer))
+        task.add_done_callback(functools.partial(self._finished, user_id))
+
+    async def _answer(self, client: Client, query: InlineQuery, answer):
+        """Wait out the debounce window, then answer, recording latency and errors like a handler"""
+        if self.window and not query.offset:
+            await asyncio.sleep(self.window)
+        self._answering.add(asyncio.current_task())
+        started = time.perf_counter()
+        try:
+            await answer(client, query)
+        except Exception as e:
+            metrics.inc("handler_errors", answer.__name__)
+            logger.error(f"Error answering inline query from {query.from_user.id}: {e}")
+        finally:
+            metrics.observe("handler", answer.__name__, time.perf_counter() - started)
+
+    def _finished(self, user_id: int, task: asyncio.Task):
+        self._answering.discard(task)
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+inline_debouncer = InlineDebouncer(window=INLINE_DEBOUNCE)
+
 # Inline query handler
-@app.on_inline_query()
+@app.on_inline_query(group=GROUP_HANDLERS)
+@instrument_handler
 async def inline_query_handler(client: Client, query: InlineQuery):
     """Handle inline queries for file search"""
-    user_id = query.from_user.id
-    
-    # Check if user is banned
-    if await is_banned(user_id):
-        return
+    inline_debouncer.submit(client, query, answer_inline_query)
+
+async def answer_inline_query(client: Client, query: InlineQuery):
+    """Search files and answer an inline query (banned users are dropped by inline_context)"""
+    context = update_context(query)
     
     # Check if user is subscribed to required channel
-    if not await check_user_subscription(user_id):
+    if not await context.is_subscribed():
         # Show subscription required message
         results = [
             InlineQueryResultArticle(
@@ -665,16 +3661,28 @@ async def inline_query_handler(client: Client, query: InlineQuery):
         return
     
     # Add user to database
-    await add_user(user_id, query.from_user.username, query.from_user.first_name)
+    await context.register()
     
     query_text = query.query.strip()
+    # Recent files for an empty query, search results otherwise
+    page_size = 20 if query_text else 10
+    cache_key = (normalize_text(query_text), query.offset)
+    cached = query_cache.get(cache_key)
     
-    if not query_text:
-        # Show recent files if no query
-        files = await FileDocument.search_files("", limit=10)
+    if cached is not None:
+        files, results = cached
     else:
-        # Search files
-        files = await FileDocument.search_files(query_text, limit=20)
+        files = await FileDocument.search_files(query_text, limit=page_size, offset=query.offset)
+        results = build_file_results(files)
+        query_cache.put(cache_key, files, results)
+    
+    # A full page means there may be more; the last result is the cursor for the next one
+    next_offset = encode_cursor(files[-1]) if len(files) == page_size and "_id" in files[-1] else ""
+    
+    if query.offset and not files:
+        # End of the result list
+        await query.answer([], cache_time=300, next_offset="")
+        return
     
     if not files:
         # No results found
@@ -687,79 +3695,26 @@ async def inline_query_handler(client: Client, query: InlineQuery):
                 )
             )
         ]
-    else:
-        results = []
-        for file_doc in files:
-            # Create result based on file type
-            if file_doc["file_type"] == "video":
-                results.append(
-                    InlineQueryResultArticle(
-                        title=f"🎬 {file_doc['file_name']}",
-                        description=f"Video • {file_doc['file_size'] // (1024*1024)}MB",
-                        input_message_content=InputTextMessageContent(
-                            f"🎬 <b>{file_doc['file_name']}</b>\n\n"
-                            f"📁 Type: Video\n"
-                            f"📊 Size: {file_doc['file_size'] // (1024*1024)}MB\n"
-                            f"📅 Added: {file_doc['added_at'].strftime('%Y-%m-%d')}"
-                        ),
-                        thumb_url="https://img.icons8.com/color/48/000000/video.png"
-                    )
-                )
-            elif file_doc["file_type"] == "audio":
-                results.append(
-                    InlineQueryResultArticle(
-                        title=f"🎵 {file_doc['file_name']}",
-                        description=f"Audio • {file_doc['file_size'] // (1024*1024)}MB",
-                        input_message_content=InputTextMessageContent(
-                            f"🎵 <b>{file_doc['file_name']}</b>\n\n"
-                            f"📁 Type: Audio\n"
-                            f"📊 Size: {file_doc['file_size'] // (1024*1024)}MB\n"
-                            f"📅 Added: {file_doc['added_at'].strftime('%Y-%m-%d')}"
-                        ),
-                        thumb_url="https://img.icons8.com/color/48/000000/audio.png"
-                    )
-                )
-            elif file_doc["file_type"] == "document":
-                results.append(
-                    InlineQueryResultArticle(
-                        title=f"📄 {file_doc['file_name']}",
-                        description=f"Document • {file_doc['file_size'] // (1024*1024)}MB",
-                        input_message_content=InputTextMessageContent(
-                            f"📄 <b>{file_doc['file_name']}</b>\n\n"
-                            f"📁 Type: Document\n"
-                            f"📊 Size: {file_doc['file_size'] // (1024*1024)}MB\n"
-                            f"📅 Added: {file_doc['added_at'].strftime('%Y-%m-%d')}"
-                        ),
-                        thumb_url="https://img.icons8.com/color/48/000000/document.png"
-                    )
-                )
-            else:
-                results.append(
-                    InlineQueryResultArticle(
-                        title=f"📁 {file_doc['file_name']}",
-                        description=f"File • {file_doc['file_size'] // (1024*1024)}MB",
-                        input_message_content=InputTextMessageContent(
-                            f"📁 <b>{file_doc['file_name']}</b>\n\n"
-                            f"📁 Type: {file_doc['file_type'].title()}\n"
-                            f"📊 Size: {file_doc['file_size'] // (1024*1024)}MB\n"
-                            f"📅 Added: {file_doc['added_at'].strftime('%Y-%m-%d')}"
-                        )
-                    )
-                )
     
-    await query.answer(results, cache_time=300)
+    await query.answer(results, cache_time=300, next_offset=next_offset)
+
+# Chosen inline results
+@app.on_chosen_inline_result(group=GROUP_HANDLERS)
+@instrument_handler
+async def chosen_inline_result_handler(client: Client, chosen: ChosenInlineResult):
+    """Count a picked inline result towards its file's download_count"""
+    try:
+        object_id = ObjectId(chosen.result_id)
+    except Exception:
+        # Subscription prompts and "no files" results are not files
+        return
+    download_counter.record(object_id)
 
 # Callback query handler
-@app.on_callback_query()
+@app.on_callback_query(group=GROUP_HANDLERS)
+@instrument_handler
 async def callback_query_handler(client: Client, callback_query: CallbackQuery):
-    """Handle callback queries"""
-    user_id = callback_query.from_user.id
-    
-    # Check if user is banned
-    if await is_banned(user_id):
-        await callback_query.answer("❌ You are banned from using this bot.", show_alert=True)
-        return
-    
+    """Handle callback queries (banned users are turned away by callback_context)"""
     data = callback_query.data
     
     if data == "help":
@@ -823,7 +3778,7 @@ async def callback_query_handler(client: Client, callback_query: CallbackQuery):
     
     elif data == "check_sub":
         # Check subscription status
-        if await check_user_subscription(callback_query.from_user.id):
+        if await update_context(callback_query).is_subscribed(refresh=True):
             await callback_query.edit_message_text(
                 "✅ <b>Subscription Verified!</b>\n\n"
                 "You are now subscribed to our channel. You can use the bot normally.\n\n"
@@ -842,8 +3797,29 @@ async def callback_query_handler(client: Client, callback_query: CallbackQuery):
     
     await callback_query.answer()
 
+# Chat member updates
+@app.on_chat_member_updated(group=GROUP_HANDLERS)
+@instrument_handler
+async def chat_member_handler(client: Client, update: ChatMemberUpdated):
+    """Mirror admin changes of every chat and join/leave events of the required channel"""
+    member = update.new_chat_member or update.old_chat_member
+    if member is None or member.user is None:
+        return
+    
+    is_admin_now = update.new_chat_member is not None and update.new_chat_member.status in ADMIN_STATUSES
+    admin_cache.update(update.chat.id, member.user.id, is_admin_now)
+    
+    if not is_required_channel(update.chat):
+        return
+    
+    is_member = update.new_chat_member is not None and update.new_chat_member.status not in [
+        enums.ChatMemberStatus.LEFT, enums.ChatMemberStatus.BANNED
+    ]
+    membership_mirror.remember(member.user.id, is_member, from_update=True)
+
 # Welcome message for new group members
-@app.on_message(filters.new_chat_members)
+@app.on_message(filters.new_chat_members, group=GROUP_HANDLERS)
+@instrument_handler
 async def welcome_new_members(client: Client, message: Message):
     """Welcome new group members"""
     for new_member in message.new_chat_members:
@@ -909,28 +3885,20 @@ Enjoy your stay! 🚀
             await message.reply(welcome_text)
 
 # Error handlers
-@app.on_message(filters.all)
+@app.on_message(filters.all, group=GROUP_TRACKING)
+@instrument_handler
 async def error_handler(client: Client, message: Message):
-    """Handle errors and unknown commands"""
+    """Register the sender of every message (banned users' commands get here; register() skips them)"""
     try:
-        # Check if user is banned
-        if await is_banned(message.from_user.id):
-            return
-        
-        # Add user to database
-        await add_user(
-            message.from_user.id,
-            message.from_user.username,
-            message.from_user.first_name
-        )
+        # Add user to database, once per update even if a command handler already did
+        await update_context(message).register()
         
     except Exception as e:
         logger.error(f"Error in error_handler: {e}")
 
 # Startup event
-@app.on_ready()
 async def startup_handler():
-    """Handle bot startup"""
+    """Log the bot identity once connected (Pyrogram has no on_ready; called from main)"""
     logger.info("🚀 AutoFilter Bot is starting...")
     logger.info(f"Bot username: @{app.me.username}")
     logger.info(f"Bot ID: {app.me.id}")
@@ -939,7 +3907,7 @@ async def startup_handler():
 
 # Shutdown event
 @app.on_disconnect()
-async def shutdown_handler():
+async def shutdown_handler(client: Client):
     """Handle bot shutdown"""
     logger.info("🛑 AutoFilter Bot is shutting down...")
     logger.info("✅ Bot stopped successfully!")
@@ -949,20 +3917,60 @@ async def main():
     """Main function to run the bot"""
     try:
         logger.info("Starting AutoFilter Bot...")
+        
+        # Create and verify indexes before handling any update
+        if not await ensure_schema(check=SCHEMA_CHECK) and SCHEMA_CHECK:
+            logger.error("Database schema check failed, refusing to start")
+            return
+        
+        if search_backend.name == "memory":
+            await search_index.load()
+            # Fork before the bot starts so workers inherit the index and no Telegram connection
+            search_workers.start(search_index)
+        
+        await banned_users.load()
+        logger.info(f"Loaded {banned_users.count:,} banned users")
+        
+        await stats.load()
+        await featured_files.load()
+        
+        ingest_pipeline.start()
+        
         await app.start()
-        logger.info("Bot started successfully!")
+        await startup_handler()
+        
+        start_background_task(run_periodically(BAN_RECONCILE_INTERVAL, banned_users.load, "banned users reconcile"))
+        start_background_task(run_periodically(USER_FLUSH_INTERVAL, user_activity.flush, "user activity flush"))
+        start_background_task(run_periodically(DOWNLOAD_FLUSH_INTERVAL, download_counter.flush, "download count flush"))
+        start_background_task(admin_cache.prefill())
+        start_background_task(run_periodically(MONGO_POOL_LOG_INTERVAL, mongo_pool_metrics.log_summary, "mongo pool summary"))
+        if METRICS_PORT:
+            start_background_task(serve_metrics(METRICS_HOST, METRICS_PORT))
+        start_background_task(run_periodically(STATS_RECONCILE_INTERVAL, stats.reconcile_counts, "stats reconcile"))
+        start_background_task(run_periodically(STATS_TYPE_RECONCILE_INTERVAL, stats.reconcile_types, "file type stats"))
         
         # Keep the bot running
-        await app.idle()
+        await idle()
         
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
     finally:
-        await app.stop()
+        await broadcast_engine.stop()
+        await channel_backfill.stop()
+        await stop_background_tasks()
+        await user_activity.close()
+        await download_counter.flush()
+        search_workers.stop()
+        if app.is_connected:
+            await app.stop()
         logger.info("Bot stopped")
 
 if __name__ == "__main__":
+    if "--check-schema" in sys.argv:
+        # Verify indexes and query plans without starting the bot
+        sys.exit(0 if asyncio.run(ensure_schema(check=True)) else 1)
+    
     # Run the bot
     asyncio.run(main())
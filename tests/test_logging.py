@@ -0,0 +1,36 @@
+"""Tests for bot.py log rotation"""
+import logging
+
+import bot
+
+
+def emit_lines(handler: logging.Handler, count: int):
+    for i in range(count):
+        handler.emit(logging.LogRecord("test", logging.INFO, __file__, 0, f"line {i:05d}", None, None))
+
+
+def test_size_rollovers_within_one_period_keep_the_newest_lines(tmp_path):
+    log_file = tmp_path / "bot.log"
+    handler = bot.SizedTimedRotatingFileHandler(
+        str(log_file), max_bytes=2000, when="midnight", backupCount=3, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    emit_lines(handler, 1500)
+    handler.close()
+
+    backups = sorted(path.name for path in tmp_path.iterdir() if path != log_file)
+    assert len(backups) == 3
+    numbers = {}
+    for path in tmp_path.iterdir():
+        numbers[path.name] = [int(line.split()[1]) for line in path.read_text().splitlines()]
+
+    # The live file and its backups hold one unbroken run that ends at the last line
+    lines = sorted(number for values in numbers.values() for number in values)
+    assert lines == list(range(1500 - len(lines), 1500))
+
+    # The dated backup is the newest, then .1, .2
+    dated, first, second = backups
+    assert first == f"{dated}.1" and second == f"{dated}.2"
+    assert max(numbers[second]) < min(numbers[first])
+    assert max(numbers[first]) < min(numbers[dated])
+    assert max(numbers[dated]) < min(numbers["bot.log"])